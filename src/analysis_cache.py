@@ -0,0 +1,85 @@
+import sqlite3
+import time
+
+import chess.polyglot
+
+
+# Persistent cache of engine analysis, stored in a SQLite file
+# Maps (position, depth, skill level, MultiPV) to (best move, score, PV)
+# and keeps at most max_entries positions, evicting the least recently used
+class AnalysisCache:
+    def __init__(self, path, max_entries=200000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "key INTEGER NOT NULL, "
+            "depth INTEGER NOT NULL, "
+            "skill_level INTEGER NOT NULL, "
+            "multipv INTEGER NOT NULL, "
+            "best_move TEXT NOT NULL, "
+            "score TEXT, "
+            "pv TEXT NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (key, depth, skill_level, multipv))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used)")
+        self.connection.commit()
+
+        # Number of entries, kept in memory so that eviction does not need a query per insert
+        self.entries = self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    # Returns the key of the position as a signed 64-bit integer (what SQLite can store)
+    @staticmethod
+    def get_key(board):
+        key = chess.polyglot.zobrist_hash(board)
+        return key - (1 << 64) if key >= (1 << 63) else key
+
+    # Looks the position up, searched to at least the given depth
+    # (the entries are stored under the depth the search reached)
+    # Returns (best move, score, PV, depth) of the deepest entry
+    # (Ex. ("e2e4", "cp 34", ["e2e4", "e7e5"], 15)), None if not found
+    def get(self, board, depth, skill_level, multipv):
+        row = self.connection.execute(
+            "SELECT rowid, best_move, score, pv, depth FROM analysis "
+            "WHERE key = ? AND depth >= ? AND skill_level = ? AND multipv = ? "
+            "ORDER BY depth DESC LIMIT 1",
+            (self.get_key(board), depth, skill_level, multipv)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.connection.execute("UPDATE analysis SET last_used = ? WHERE rowid = ?", (time.time(), row[0]))
+        self.connection.commit()
+        return row[1], row[2], row[3].split(" ") if row[3] else [], row[4]
+
+    # Stores the result of a search
+    def put(self, board, depth, skill_level, multipv, best_move, score, pv):
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO analysis "
+            "(key, depth, skill_level, multipv, best_move, score, pv, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.get_key(board), depth, skill_level, multipv, best_move, score, " ".join(pv), time.time())
+        )
+        self.entries += cursor.rowcount
+
+        # Evict the least recently used entries
+        if self.entries > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM analysis WHERE rowid IN "
+                "(SELECT rowid FROM analysis ORDER BY last_used ASC LIMIT ?)",
+                (self.entries - self.max_entries,)
+            )
+            self.entries = self.max_entries
+
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
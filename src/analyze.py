@@ -0,0 +1,242 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import chess
+import chess.engine
+import chess.pgn
+
+from engine import Engine
+
+# Batch analysis of PGN files, without the GUI or a browser.
+# Every position of every game is searched by a pool of long-lived Stockfish
+# processes (one per core by default), with the same engine settings as the bot.
+# The work is handed out per position, so a long game keeps every engine busy.
+# The games are written with an [%eval] comment after every move to a PGN
+# file of the same name in the output directory, in the order they were read.
+#
+# Usage: python src/analyze.py --stockfish path/to/stockfish --input games/ --output annotated/ [--depth 15]
+
+
+# A game being analyzed, with the results of its positions as they come in
+class GameJob:
+    def __init__(self, writer, index, game):
+        self.writer = writer
+        self.index = index
+        self.game = game
+        self.nodes = list(game.mainline())
+
+        # The (score, depth) of the position after every move
+        self.results = [None] * len(self.nodes)
+        self.remaining = len(self.nodes)
+        self.lock = threading.Lock()
+
+    # Stores the result of a position
+    # Returns True if it was the last one of the game
+    def set_result(self, index, score, depth):
+        with self.lock:
+            self.results[index] = (score, depth)
+            self.remaining -= 1
+            return self.remaining == 0
+
+    # Adds the evaluations to the moves of the game
+    def annotate(self):
+        for node, (score, depth) in zip(self.nodes, self.results):
+            if score is None:
+                continue
+            kind, value = score.split(" ")
+            relative = chess.engine.Mate(int(value)) if kind == "mate" else chess.engine.Cp(int(value))
+            node.set_eval(chess.engine.PovScore(relative, node.board().turn), depth)
+
+
+# Writes the analyzed games of an input file to the output file, in the order they were read
+class PgnWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+        # The index of the next game to write, and the analyzed games that have to wait for it
+        self.next_index = 0
+        self.pending = {}
+
+        # Number of games read so far
+        self.games = 0
+
+        # Set once every game of the input file has been read
+        self.read_all = False
+
+    def add(self, job):
+        self.pending[job.index] = job
+        while self.next_index in self.pending:
+            job = self.pending.pop(self.next_index)
+            job.annotate()
+            if self.file is None:
+                self.file = open(self.path, "w", encoding="utf-8")
+            print(job.game, file=self.file, end="\n\n")
+            self.next_index += 1
+        self.close_if_done()
+
+    def close_if_done(self):
+        if self.read_all and self.next_index == self.games and self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# Returns the PGN files in the given files and directories
+def find_pgn_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(".pgn")
+            )
+        else:
+            files.append(path)
+    return files
+
+
+# Searches positions from the task queue until it gets None
+def engine_worker(engine, tasks, finished, counter):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        job, index, board = task
+
+        try:
+            search = engine.start_search(board)
+            engine.finish_search(search)
+            score, _ = search.get_score_and_pv()
+            depth = search.get_stats()["depth"]
+            counter.increment()
+        except chess.engine.EngineError as e:
+            # Leave the move without an evaluation rather than stopping every other engine
+            print(f"Can't analyze {board.fen()}: {e}", file=sys.stderr)
+            score, depth = None, None
+        if job.set_result(index, score, depth):
+            finished.put(job)
+
+
+# Number of positions analyzed, shared by the engine workers
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def increment(self):
+        with self.lock:
+            self.value += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate PGN files with Stockfish evaluations")
+    parser.add_argument("--stockfish", required=True, help="path to the Stockfish executable")
+    parser.add_argument("--input", required=True, nargs="+", help="PGN files or directories of PGN files")
+    parser.add_argument("--output", required=True, help="directory for the annotated PGN files")
+    parser.add_argument("--depth", type=int, default=15)
+    parser.add_argument("--skill-level", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1, help="threads of every engine")
+    parser.add_argument("--hash", type=int, default=128, help="memory of every engine in MB")
+    parser.add_argument("--engines", type=int, default=None,
+                        help="number of engine processes (default: one per core, divided by --threads)")
+    args = parser.parse_args()
+
+    pgn_files = find_pgn_files(args.input)
+    if not pgn_files:
+        print("No PGN files found", file=sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+    if any(os.path.samefile(os.path.dirname(os.path.abspath(path)), args.output) for path in pgn_files):
+        print("The output directory can't be the directory of an input file", file=sys.stderr)
+        return 1
+
+    engine_count = args.engines or max(1, (os.cpu_count() or 1) // args.threads)
+    parameters = {
+        "Threads": args.threads,
+        "Hash": args.hash,
+        "Skill Level": args.skill_level,
+    }
+    try:
+        engines = [Engine(args.stockfish, args.depth, parameters) for _ in range(engine_count)]
+    except (OSError, chess.engine.EngineError) as e:
+        print("Can't start Stockfish: " + str(e), file=sys.stderr)
+        return 1
+
+    # A few positions per engine are queued, so that the games are read as they are needed
+    tasks = queue.Queue(maxsize=engine_count * 16)
+    finished = queue.Queue()
+    counter = Counter()
+    workers = [
+        threading.Thread(target=engine_worker, args=(engine, tasks, finished, counter), daemon=True)
+        for engine in engines
+    ]
+    for worker in workers:
+        worker.start()
+
+    # Write the games as soon as all their positions are analyzed
+    def writer_thread():
+        while True:
+            item = finished.get()
+            if item is None:
+                return
+            if isinstance(item, PgnWriter):
+                item.close_if_done()
+            else:
+                item.writer.add(item)
+
+    writer = threading.Thread(target=writer_thread)
+    writer.start()
+
+    start = time.perf_counter()
+    games = 0
+    try:
+        for path in pgn_files:
+            pgn_writer = PgnWriter(os.path.join(args.output, os.path.basename(path)))
+            with open(path, encoding="utf-8", errors="replace") as f:
+                while True:
+                    game = chess.pgn.read_game(f)
+                    if game is None:
+                        break
+                    job = GameJob(pgn_writer, pgn_writer.games, game)
+                    pgn_writer.games += 1
+                    games += 1
+                    if job.remaining == 0:
+                        finished.put(job)
+                    for index, node in enumerate(job.nodes):
+                        board = node.board()
+                        if board.is_game_over():
+                            # Nothing to search, the game ended with this move
+                            if job.set_result(index, None, None):
+                                finished.put(job)
+                            continue
+                        tasks.put((job, index, board))
+            # Let the writer close the file once its last games are written
+            pgn_writer.read_all = True
+            finished.put(pgn_writer)
+
+        for _ in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+    finally:
+        finished.put(None)
+        writer.join()
+        for engine in engines:
+            try:
+                engine.quit()
+            except chess.engine.EngineError:
+                pass
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Analyzed {counter.value} positions of {games} games in {elapsed:.1f}s "
+        f"({counter.value / elapsed if elapsed > 0 else 0:.1f} positions/s) with {engine_count} engines"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
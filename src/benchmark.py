@@ -0,0 +1,150 @@
+import argparse
+import json
+import sys
+import time
+
+import chess.pgn
+
+from grabbers.replay_grabber import ReplayGrabber
+from messages import MessageSender
+from stockfish_bot import StockfishBot
+from utilities import get_latency_stats
+
+# Headless benchmark of the bot's game loop.
+# The bot plays against the games of PGN files through a ReplayGrabber
+# (no Chrome, no site, mouseless moves) and the latency of every move is
+# split into stages:
+# - "detect": from the opponent's move showing up on the page to the bot reading it
+# - "think": picking the move (book, tablebases or engine search)
+# - "act": from the move being picked to the move being played on the page
+# - "total": from the opponent's move showing up to the bot's move being played
+# The results are printed (or written) as JSON, with the p50/p95/p99
+# of every stage in milliseconds, so that versions can be compared
+#
+# Usage: python src/benchmark.py --stockfish path/to/stockfish --pgn games.pgn [--depth 10] [--output results.json]
+
+
+# Pipe end that drops the messages meant for the GUI
+class NullPipe:
+    def send_bytes(self, data):
+        pass
+
+
+# The bot with the time it takes to pick every move recorded
+class BenchmarkBot(StockfishBot):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.think_times = []
+
+    def get_move(self, engine, board, ponder_hit):
+        start = time.perf_counter()
+        result = super().get_move(engine, board, ponder_hit)
+        self.think_times.append((start, time.perf_counter()))
+        return result
+
+
+def read_games(paths, max_games):
+    games = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            while max_games is None or len(games) < max_games:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                if game.board().fen() == chess.STARTING_FEN and next(iter(game.mainline_moves()), None) is not None:
+                    games.append(game)
+    return games
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's move latency against PGN games, without a browser")
+    parser.add_argument("--stockfish", required=True, help="path to the Stockfish executable")
+    parser.add_argument("--pgn", required=True, nargs="+", help="PGN files with the games to replay")
+    parser.add_argument("--max-games", type=int, default=None, help="maximum number of games to read")
+    parser.add_argument("--color", choices=["white", "black", "both"], default="both", help="the color of the bot")
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--skill-level", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--hash", type=int, default=64, help="engine memory in MB")
+    parser.add_argument("--multipv", type=int, default=1)
+    parser.add_argument("--book", default="", help="Polyglot opening book")
+    parser.add_argument("--syzygy", default="", help="Syzygy tablebases directory")
+    parser.add_argument("--opponent-delay", type=float, default=0.1, help="seconds before the opponent replies")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the opponent's moves once the bot leaves the game")
+    parser.add_argument("--output", default=None, help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    games = read_games(args.pgn, args.max_games)
+    if not games:
+        print("No games found in the PGN files", file=sys.stderr)
+        return 1
+    colors = {"white": [True], "black": [False], "both": [True, False]}[args.color]
+
+    bot = BenchmarkBot(
+        None, None, "replay", NullPipe(), args.stockfish,
+        False, True, False, False, 0.0, False, 100, args.skill_level, args.depth,
+        args.hash, args.threads, args.book, "best", 20, args.syzygy, False, False, 0, args.multipv, False, None
+    )
+    bot.sender = MessageSender(bot.pipe)
+    engine = bot.init_engine()
+    if engine is None:
+        print("Can't start Stockfish, open the opening book or the tablebases", file=sys.stderr)
+        return 1
+
+    stages = {"detect": [], "think": [], "act": [], "total": []}
+    bot_moves = 0
+    games_played = 0
+    start = time.perf_counter()
+    try:
+        for i, game in enumerate(games):
+            for is_white in colors:
+                bot.grabber = ReplayGrabber(game, is_white, args.opponent_delay, args.seed + i)
+                bot.think_times = []
+                bot.play_game(engine, True)
+                engine.stop_ponder()
+                games_played += 1
+
+                # Every move that was played has a think time and a timeline
+                # entry (a game can end while the bot is thinking)
+                for (think_start, think_end), times in zip(bot.think_times, bot.grabber.timeline):
+                    bot_moves += 1
+                    stages["think"].append(think_end - think_start)
+                    stages["act"].append(times["acted"] - think_end)
+                    if times["shown"] is not None:
+                        stages["detect"].append(times["seen"] - times["shown"])
+                        stages["total"].append(times["acted"] - times["shown"])
+    finally:
+        engine.quit()
+    wall_time = time.perf_counter() - start
+
+    # The bot's own time per move (without waiting for the opponent)
+    bot_time = sum(stages["think"]) + sum(stages["act"]) + sum(stages["detect"])
+    results = {
+        "settings": {
+            "depth": args.depth,
+            "skill_level": args.skill_level,
+            "threads": args.threads,
+            "hash": args.hash,
+            "multipv": args.multipv,
+            "book": args.book != "",
+            "syzygy": args.syzygy != "",
+            "opponent_delay": args.opponent_delay,
+        },
+        "games": games_played,
+        "moves": bot_moves,
+        "wall_time": wall_time,
+        "moves_per_second": bot_moves / bot_time if bot_time > 0 else None,
+        "stages": {name: get_latency_stats(values) for name, values in stages.items()},
+    }
+
+    data = json.dumps(results, indent=2)
+    if args.output is None:
+        print(data)
+    else:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import chess
+
+
+# Keeps a python-chess board in sync with the move list shown on the page.
+# Irregular updates (takebacks, several moves landing between two polls,
+# the page re-rendering the list) are handled by undoing only the moves
+# after the first difference and playing the new ones
+class BoardSync:
+    def __init__(self):
+        self.board = chess.Board()
+
+        # The moves as written on the page (or as played by the bot
+        # until the page shows them), one for every move on the board
+        self.moves = []
+
+        # Number of moves in self.moves that the page has already shown
+        self.confirmed = 0
+
+    # Plays a move of the bot that the page may not show yet
+    # Returns the move in SAN (Ex. "Nf3")
+    def push(self, move):
+        move = chess.Move.from_uci(move)
+        san = self.board.san(move)
+        self.board.push(move)
+        self.moves.append(san)
+        return san
+
+    # Brings the board to the given move list from the page
+    # Ex. ["e4", "c5", "Nf3"]
+    # Returns None if nothing changed, otherwise (index, moves): every move
+    # from index on has been replaced by the given moves (Ex. (2, ["Nf3"]))
+    def update(self, moves):
+        # Find the first move that is written differently on the page
+        common = 0
+        while common < len(self.moves) and common < len(moves) and self.moves[common] == moves[common]:
+            common += 1
+
+        # The page shows the same moves, or it has not shown the last moves of the bot yet
+        if common == len(moves) and self.confirmed <= len(moves):
+            self.confirmed = len(moves)
+            return None
+
+        # Undo the moves after the first difference
+        undone = []
+        while len(self.board.move_stack) > common:
+            undone.append(self.board.pop())
+        undone.reverse()
+        del self.moves[common:]
+
+        # Play the moves from the page. Moves that are the same as the undone ones
+        # (only written differently, Ex. "e8=Q" and "e8Q") don't count as changes
+        first_change = None
+        for i, san in enumerate(moves[common:]):
+            try:
+                move = self.board.parse_san(san)
+            except ValueError:
+                # Not a move (Ex. the "1-0" result)
+                break
+            self.board.push(move)
+            self.moves.append(san)
+            if first_change is None and (i >= len(undone) or undone[i] != move):
+                first_change = common + i
+
+        self.confirmed = len(self.moves)
+
+        # Moves at the end were undone and nothing replaced them
+        if first_change is None and len(undone) > len(self.moves) - common:
+            first_change = len(self.moves)
+
+        if first_change is None:
+            return None
+        return first_change, self.moves[first_change:]
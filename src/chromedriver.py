@@ -0,0 +1,106 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+# Finds the chromedriver for the installed Chrome without going to the network.
+# The Chrome version is read locally (the registry on Windows, "--version"
+# elsewhere) and its major version is looked up in an index of the
+# chromedriver binaries downloaded so far, stored in the cache directory:
+#     index.json: {"120": {"chrome_version": "120.0.6099.109", "path": ".../120/chromedriver"}}
+# Only on a cache miss is the driver downloaded (with webdriver_manager),
+# and it is then copied into the cache, so the next launches work offline
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".chess-auto-bot", "chromedriver")
+
+DRIVER_NAME = "chromedriver.exe" if os.name == "nt" else "chromedriver"
+
+# Where Chrome can be found, on platforms where its version is read with "--version"
+CHROME_COMMANDS = {
+    "darwin": ["/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"],
+    "linux": ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser"],
+}
+
+VERSION_PATTERN = re.compile(r"(\d+)\.\d+\.\d+\.\d+")
+
+
+# Returns the version of the installed Chrome (Ex. "120.0.6099.109"), None if it isn't found
+def get_chrome_version():
+    if sys.platform == "win32":
+        import winreg
+        for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+            try:
+                with winreg.OpenKey(root, r"Software\Google\Chrome\BLBeacon") as key:
+                    version = winreg.QueryValueEx(key, "version")[0]
+            except OSError:
+                continue
+            match = VERSION_PATTERN.search(version)
+            if match is not None:
+                return match.group(0)
+        return None
+
+    platform = "darwin" if sys.platform == "darwin" else "linux"
+    for command in CHROME_COMMANDS[platform]:
+        try:
+            output = subprocess.run([command, "--version"], capture_output=True, text=True, timeout=5).stdout
+        except (OSError, subprocess.SubprocessError):
+            continue
+        match = VERSION_PATTERN.search(output)
+        if match is not None:
+            return match.group(0)
+    return None
+
+
+def read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "index.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_index(cache_dir, index):
+    # Written to a temporary file first, so a crash never leaves a broken index
+    path = os.path.join(cache_dir, "index.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# Downloads the chromedriver for the installed Chrome with webdriver_manager
+# Returns the path of the chromedriver executable
+def download_chromedriver():
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    # install() can return another file of the downloaded archive, so look for the driver next to it
+    path = os.path.join(os.path.dirname(ChromeDriverManager().install()), DRIVER_NAME)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"{DRIVER_NAME} was not found in the downloaded archive")
+    return path
+
+
+# Returns the path of the chromedriver for the installed Chrome,
+# downloading it only if the cache has none for its major version
+def get_chromedriver_path(cache_dir=CACHE_DIR):
+    chrome_version = get_chrome_version()
+    if chrome_version is None:
+        # Without the version there is no cache key, so let webdriver_manager find it
+        return download_chromedriver()
+    major = chrome_version.split(".")[0]
+
+    index = read_index(cache_dir)
+    entry = index.get(major)
+    if entry is not None and os.access(entry["path"], os.X_OK):
+        return entry["path"]
+
+    # Keep a copy, so the cache doesn't depend on where webdriver_manager stores its downloads
+    downloaded_path = download_chromedriver()
+    path = os.path.join(cache_dir, major, DRIVER_NAME)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copy2(downloaded_path, path)
+
+    index[major] = {"chrome_version": chrome_version, "path": path}
+    write_index(cache_dir, index)
+    return path
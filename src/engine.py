@@ -0,0 +1,275 @@
+import threading
+import time
+
+import chess
+import chess.engine
+
+import tracing
+
+
+# A search running in the background on the engine
+# The game loop can keep doing other work (like watching the page)
+# and collect the result once the search is done
+class Search:
+    def __init__(self, engine, board, limit, game, multipv=1):
+        self.board = board
+        self.started = time.perf_counter()
+        self.finished = None
+        self.result = None
+        self._done = threading.Event()
+
+        # Stops the search when its time is up (see set_deadline)
+        self._deadline = None
+        self._analysis = engine.analysis(board, limit, multipv=multipv, game=game, info=chess.engine.INFO_ALL)
+
+        # Wait for the bestmove line in the background
+        self._thread = threading.Thread(target=self._wait_for_result, daemon=True)
+        self._thread.start()
+
+    def _wait_for_result(self):
+        try:
+            self.result = self._analysis.wait()
+        except chess.engine.EngineError:
+            self.result = None
+        self.finished = time.perf_counter()
+        if self._deadline is not None:
+            self._deadline.cancel()
+        self._done.set()
+
+    # Returns True if the search is done
+    def is_done(self):
+        return self._done.is_set()
+
+    # Blocks until the search is done or until the timeout (in seconds) passes
+    # Returns True if the search is done
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    # Lets the search run for the given time (in seconds) from now at most,
+    # the engine then answers with the best move it has found
+    def set_deadline(self, seconds):
+        self._deadline = threading.Timer(seconds, self._analysis.stop)
+        self._deadline.daemon = True
+        self._deadline.start()
+
+    # Stops the search and waits for the engine to answer with its best move
+    def stop(self):
+        with tracing.span("stop_search", "engine"):
+            self._analysis.stop()
+            self._done.wait()
+
+    # Returns the best move (Ex. "e2e4"), None if there are no legal moves
+    def get_best_move(self):
+        self.wait()
+        if self.result is None or self.result.move is None:
+            return None
+        return self.result.move.uci()
+
+    # Returns the expected reply of the opponent (Ex. "e7e5"), None if there isn't one
+    def get_ponder_move(self):
+        self.wait()
+        if self.result is None or self.result.ponder is None:
+            return None
+        return self.result.ponder.uci()
+
+    # Returns the score (Ex. "cp 34", "mate -3", None if not found) from the point
+    # of view of the side to move and the principal variation (Ex. ["e2e4", "e7e5"])
+    # of a line of the search
+    @staticmethod
+    def get_line(info):
+        score = None
+        if "score" in info:
+            relative = info["score"].relative
+            if relative.is_mate():
+                score = "mate " + str(relative.mate())
+            else:
+                score = "cp " + str(relative.score())
+        pv = [move.uci() for move in info.get("pv", [])]
+        return score, pv
+
+    # Returns the score and the principal variation of the best line (see get_line)
+    def get_score_and_pv(self):
+        return self.get_line(self._analysis.info)
+
+    # Returns the score and the principal variation of every line
+    # when searching with MultiPV, best first (see get_line)
+    def get_lines(self):
+        return [self.get_line(info) for info in self._analysis.multipv if "pv" in info]
+
+    # Returns what the engine has reported so far for the best line:
+    # the depth and selective depth, the score, the nodes and nodes per
+    # second, how full the hash table is (in permille) and the principal variation
+    def get_info(self):
+        info = self._analysis.info
+        score, pv = self.get_line(info)
+        return {
+            "time": time.perf_counter() - self.started,
+            "depth": info.get("depth"),
+            "seldepth": info.get("seldepth"),
+            "score": score,
+            "nodes": info.get("nodes"),
+            "nps": info.get("nps"),
+            "hashfull": info.get("hashfull"),
+            "pv": pv,
+        }
+
+    # Returns the timing of the search for benchmarking:
+    # the time from "go" to "bestmove" (in seconds), the depth reached,
+    # the nodes searched and the nodes per second
+    def get_stats(self):
+        info = self._analysis.info
+        return {
+            "time": (self.finished if self.finished is not None else time.perf_counter()) - self.started,
+            "depth": info.get("depth"),
+            "nodes": info.get("nodes"),
+            "nps": info.get("nps"),
+        }
+
+
+# UCI engine used by the bot, built on python-chess.
+# The engine process is driven by python-chess in a background thread,
+# so searches don't block the game loop and can be stopped at any time.
+# It can also think on the opponent's time: the expected reply of the
+# opponent (the "ponder" move of the last search) is kept, and a search
+# on the position after it can run while waiting for the opponent.
+# This is not UCI pondering ("go ponder"/"ponderhit", which python-chess
+# doesn't expose): the ponder search is a normal search up to the depth,
+# with no time limit, and on a ponder hit it is given a deadline from the clock.
+# With multipv > 1 every search also finds the next best moves
+class Engine:
+    # On a ponder hit, the search gets the time left spread
+    # over this many moves, plus the increment
+    PONDER_HIT_MOVES = 40
+
+    def __init__(self, path, depth, parameters, multipv=1):
+        self.depth = depth
+        self.multipv = multipv
+        self.engine = chess.engine.SimpleEngine.popen_uci(path)
+
+        # Only set the options the engine has (some were removed in newer Stockfish versions)
+        self.engine.configure({name: value for name, value in parameters.items() if name in self.engine.options})
+
+        # Time kept in reserve for the lag of every move (in seconds)
+        self.move_overhead = parameters.get("Move Overhead", 0) / 1000
+
+        # Used by python-chess to send "ucinewgame" when a new game starts
+        self.game = object()
+
+        # The last search that was started for the player
+        self.last_search = None
+
+        # The expected reply from the last search, None if there isn't one
+        self.ponder_move = None
+
+        # The search on the position after the ponder move, None if not pondering
+        self.ponder_search = None
+
+    @property
+    def pondering(self):
+        return self.ponder_search is not None
+
+    # Lets the engine probe the Syzygy tablebases in the given directory
+    def set_syzygy_path(self, path):
+        if "SyzygyPath" in self.engine.options:
+            self.engine.configure({"SyzygyPath": path})
+
+    # Starts a new game, so that the engine clears its state
+    # ("ucinewgame" is sent with the next search)
+    def new_game(self):
+        self.stop_ponder()
+        self.game = object()
+        self.ponder_move = None
+
+    # Returns the search limit for the player to move on the given board.
+    # With a clock ({"player", "opponent", "increment"} in seconds, see
+    # Grabber.snapshot) the engine manages its time from the remaining
+    # time, otherwise it searches up to the fixed depth
+    def get_limit(self, board, clock=None):
+        if clock is None or clock["player"] is None or clock["opponent"] is None:
+            return chess.engine.Limit(depth=self.depth)
+
+        if board.turn == chess.WHITE:
+            white_clock, black_clock = clock["player"], clock["opponent"]
+        else:
+            white_clock, black_clock = clock["opponent"], clock["player"]
+
+        # The depth still caps the search when there is plenty of time
+        return chess.engine.Limit(
+            white_clock=white_clock,
+            black_clock=black_clock,
+            white_inc=clock["increment"],
+            black_inc=clock["increment"],
+            depth=self.depth
+        )
+
+    # Starts searching the given position in the background
+    def start_search(self, board, clock=None):
+        with tracing.span("start_search", "engine"):
+            self.last_search = Search(self.engine, board.copy(), self.get_limit(board, clock), self.game, self.multipv)
+        return self.last_search
+
+    # Waits for a search to finish and keeps its ponder move
+    # Returns the best move (Ex. "e2e4"), None if there are no legal moves
+    def finish_search(self, search):
+        with tracing.span("finish_search", "engine"):
+            self.ponder_move = search.get_ponder_move()
+            return search.get_best_move()
+
+    # Searches the given position
+    # Returns the best move (Ex. "e2e4"), None if there are no legal moves
+    def get_best_move(self, board, clock=None):
+        return self.finish_search(self.start_search(board, clock))
+
+    # Starts a search on the opponent's time, assuming that the
+    # opponent replies to the given position with self.ponder_move.
+    # It is only limited by the depth, so that it keeps going however
+    # long the opponent thinks (see ponder_hit for the clocks)
+    # Returns False if there is no move to ponder on
+    def start_ponder(self, board):
+        if self.ponder_move is None:
+            return False
+
+        ponder_move = chess.Move.from_uci(self.ponder_move)
+        if not board.is_legal(ponder_move):
+            return False
+
+        ponder_board = board.copy()
+        ponder_board.push(ponder_move)
+        with tracing.span("start_ponder", "engine"):
+            self.ponder_search = Search(self.engine, ponder_board, chess.engine.Limit(depth=self.depth), self.game, self.multipv)
+        return True
+
+    # Returns the time to give the player's move on a ponder hit (in seconds),
+    # with the given clocks (see get_limit)
+    def get_ponder_hit_time(self, clock):
+        time_left = max(0.0, clock["player"] - self.move_overhead)
+        return min(time_left / self.PONDER_HIT_MOVES + clock["increment"], time_left / 2)
+
+    # Called when the opponent played the expected move, with the clocks
+    # after that move (see get_limit).
+    # Returns the ponder search, which becomes the search for the player's move.
+    # It keeps going with everything it found so far, until it reaches the
+    # depth or, with a clock, until the time for the move is up
+    # (the limit of a running search can't be changed, so it is stopped then)
+    def ponder_hit(self, clock=None):
+        search = self.ponder_search
+        self.ponder_search = None
+
+        if clock is not None and clock["player"] is not None and not search.is_done():
+            with tracing.span("ponder_hit", "engine"):
+                search.set_deadline(self.get_ponder_hit_time(clock))
+
+        self.last_search = search
+        return search
+
+    # Stops the ponder search (if there is one) and discards its result
+    def stop_ponder(self):
+        if self.ponder_search is None:
+            return
+
+        self.ponder_search.stop()
+        self.ponder_search = None
+
+    def quit(self):
+        self.stop_ponder()
+        self.engine.quit()
@@ -0,0 +1,103 @@
+# Evaluation graph of the match, one point per engine search.
+# The points are drawn on a Tk canvas as a single line, and when there
+# are more points than pixel columns, every column only keeps its lowest
+# and highest evaluation. That way the drawing never has more than two
+# points per column, no matter how long the game gets, and short swings
+# (like a blunder) stay visible
+class EvalGraph:
+    # Time between two redraws (in milliseconds)
+    FRAME_TIME = 50
+
+    # Evaluations are clipped to +-MAX_CP centipawns (mates included)
+    MAX_CP = 1000
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.width = int(canvas["width"])
+        self.height = int(canvas["height"])
+
+        # The (ply, centipawns from white's point of view) points
+        self.points = []
+
+        self.redraw_pending = False
+
+        # The zero line and the evaluation line
+        self.canvas.create_line(0, self.height / 2, self.width, self.height / 2, fill="gray")
+        self.line = self.canvas.create_line(0, 0, 0, 0, fill="red", width=2)
+
+    # Converts a score (Ex. "cp 34", "mate -3") from the point of view of
+    # the side to move at the given ply to centipawns from white's point of view
+    @classmethod
+    def get_white_cp(cls, score, ply):
+        kind, value = score.split(" ")
+        if kind == "mate":
+            cp = cls.MAX_CP if int(value) > 0 else -cls.MAX_CP
+        else:
+            cp = max(-cls.MAX_CP, min(cls.MAX_CP, int(value)))
+        return cp if ply % 2 == 0 else -cp
+
+    # Adds the score of the search at the given ply (the number of moves played)
+    def add(self, ply, score):
+        if score is None:
+            return
+        self.truncate(ply)
+        self.points.append((ply, self.get_white_cp(score, ply)))
+        self.schedule_redraw()
+
+    # Removes the points after the given ply (Ex. after a takeback)
+    def truncate(self, ply):
+        while self.points and self.points[-1][0] >= ply:
+            self.points.pop()
+        self.schedule_redraw()
+
+    def clear(self):
+        self.points = []
+        self.schedule_redraw()
+
+    # Redraws the graph on the next frame (once, no matter how many times it is called)
+    def schedule_redraw(self):
+        if self.redraw_pending:
+            return
+        self.redraw_pending = True
+        self.canvas.after(self.FRAME_TIME, self.redraw)
+
+    # Returns the points to draw as (x, y) pixels, at most two per column
+    def get_decimated_points(self):
+        if not self.points:
+            return []
+
+        last_ply = max(self.points[-1][0], 1)
+        columns = {}
+        for ply, cp in self.points:
+            x = int(ply / last_ply * (self.width - 1))
+            if x not in columns:
+                columns[x] = [cp, cp]
+            else:
+                column = columns[x]
+                column[0] = min(column[0], cp)
+                column[1] = max(column[1], cp)
+
+        pixels = []
+        for x, (low, high) in columns.items():
+            pixels.append((x, self.cp_to_y(high)))
+            if low != high:
+                pixels.append((x, self.cp_to_y(low)))
+        return pixels
+
+    def cp_to_y(self, cp):
+        return (self.height - 1) * (1 - (cp + self.MAX_CP) / (2 * self.MAX_CP))
+
+    def redraw(self):
+        self.redraw_pending = False
+
+        pixels = self.get_decimated_points()
+
+        if not pixels:
+            self.canvas.itemconfigure(self.line, state="hidden")
+            return
+
+        # A line needs at least two points
+        if len(pixels) == 1:
+            pixels.append(pixels[0])
+        self.canvas.coords(self.line, *[value for pixel in pixels for value in pixel])
+        self.canvas.itemconfigure(self.line, state="normal")
@@ -1,121 +1,110 @@
-from selenium.common import NoSuchElementException
-from selenium.webdriver.common.by import By
-
-from grabbers.grabber import Grabber
+from grabbers.grabber import Grabber, SNAPSHOT_HELPERS_SCRIPT
+
+# Reads the board, the player color, the game over window, the move
+# list and the clocks from the page (see Grabber.snapshot)
+SNAPSHOT_SCRIPT = SNAPSHOT_HELPERS_SCRIPT + """
+var boardElem = document.getElementById("board-play-computer") || document.getElementById("board-single");
+
+// Find the square with the smallest x and biggest y values (bottom left number)
+var isWhite = null;
+var coordinates = boardElem ? (boardElem.querySelector("svg.coordinates") || boardElem.querySelector("svg")) : null;
+if (coordinates) {
+    var squareNames = coordinates.querySelectorAll("*");
+    var elem = null;
+    var minX = null;
+    var maxY = null;
+    for (var i = 0; i < squareNames.length; i++) {
+        var x = parseFloat(squareNames[i].getAttribute("x"));
+        var y = parseFloat(squareNames[i].getAttribute("y"));
+        if (i === 0 || (x <= minX && y >= maxY)) {
+            minX = x;
+            maxY = y;
+            elem = squareNames[i];
+        }
+    }
+    if (elem) {
+        isWhite = elem.textContent.trim() === "1";
+    }
+}
+
+// Read the move list
+var moves = null;
+var moveListElem = document.querySelector(".play-controller-scrollable") ||
+    document.querySelector(".mode-swap-move-list-wrapper-component");
+if (moveListElem) {
+    var movesByNode = new Map();
+    moveListElem.querySelectorAll("div.node[data-node]").forEach(function (node) {
+        var moveClass = node.getAttribute("class") || "";
+        if (moveClass.indexOf("white-move") === -1 && moveClass.indexOf("black-move") === -1) {
+            return;
+        }
+
+        var figurineElem = node.querySelector("[data-figurine]");
+        var figure = figurineElem ? figurineElem.getAttribute("data-figurine") : null;
+        var text = node.innerText.trim();
+        var move;
+        if (figure === null) {
+            move = text;
+        } else if (text.indexOf("=") !== -1) {
+            move = text + figure;
+            if (move.indexOf("+") !== -1) {
+                move = move.replace("+", "") + "+";
+            }
+        } else {
+            move = figure + text;
+        }
+        movesByNode.set(node.getAttribute("data-node"), move);
+    });
+    moves = Array.from(movesByNode.values());
+}
+
+// Read the clocks (the player's clock is at the bottom)
+// and the increment from the time control (Ex. "3 | 2", or "10 min" without one)
+var clock = {
+    player: parseClock(document.querySelector(".clock-bottom .clock-time-monospace") || document.querySelector(".clock-bottom")),
+    opponent: parseClock(document.querySelector(".clock-top .clock-time-monospace") || document.querySelector(".clock-top")),
+    increment: null
+};
+var timeControlElem = document.querySelector(".time-selector-button-button") ||
+    document.querySelector(".game-overview-time-control");
+if (timeControlElem) {
+    var timeControl = timeControlElem.textContent;
+    var incrementMatch = timeControl.match(/\d+\s*\|\s*(\d+)/);
+    if (incrementMatch) {
+        clock.increment = parseInt(incrementMatch[1], 10);
+    } else if (/\d+\s*min/.test(timeControl)) {
+        clock.increment = 0;
+    }
+}
+if (clock.increment === null) {
+    // Without the increment the engine would budget its time wrongly,
+    // so leave the clocks out and let it search to the depth instead
+    clock = {player: null, opponent: null, increment: 0};
+}
+
+return {
+    moves: moves,
+    is_white: isWhite,
+    is_puzzles: false,
+    is_game_over: document.querySelector(".board-modal-container") !== null,
+    board: getBoardRect(boardElem),
+    offset: getWindowOffset(),
+    geometry_version: getGeometryVersion(),
+    clock: clock
+};
+"""
 
 
 class ChesscomGrabber(Grabber):
-    def __init__(self, chrome_url, chrome_session_id):
-        super().__init__(chrome_url, chrome_session_id)
-        self.moves_list = {}
-
-    def update_board_elem(self):
-        try:
-            self._board_elem = self.chrome.find_element(By.XPATH, "//*[@id='board-play-computer']")
-        except NoSuchElementException:
-            try:
-                self._board_elem = self.chrome.find_element(By.XPATH, "//*[@id='board-single']")
-            except NoSuchElementException:
-                self._board_elem = None
-
-    def is_white(self):
-        # Find the square names list
-        square_names = None
-        try:
-            coordinates = self.chrome.find_element(By.XPATH, "//*[@id='board-play-computer']//*[name()='svg']")
-            square_names = coordinates.find_elements(By.XPATH, ".//*")
-        except NoSuchElementException:
-            try:
-                coordinates = self.chrome.find_elements(By.XPATH, "//*[@id='board-single']//*[name()='svg']")
-                coordinates = [x for x in coordinates if x.get_attribute("class") == "coordinates"][0]
-                square_names = coordinates.find_elements(By.XPATH, ".//*")
-            except NoSuchElementException:
-                return None
-
-        # Find the square with the smallest x and biggest y values (bottom left number)
-        elem = None
-        min_x = None
-        max_y = None
-        for i in range(len(square_names)):
-            name_element = square_names[i]
-            x = float(name_element.get_attribute("x"))
-            y = float(name_element.get_attribute("y"))
-
-            if i == 0 or (x <= min_x and y >= max_y):
-                min_x = x
-                max_y = y
-                elem = name_element
-
-        # Use this square to determine whether the player is white or black
-        num = elem.text
-        return num == "1"
-
-    def is_game_over(self):
-        try:
-            # Find the game over window
-            game_over_window = self.chrome.find_element(By.CLASS_NAME, "board-modal-container")
-            return game_over_window is not None
-        except NoSuchElementException:
-            # Return False since the game over window is not found
-            return False
-
-    def get_move_list(self):
-        # Find the moves list
-        try:
-            move_list_elem = self.chrome.find_element(By.CLASS_NAME, "play-controller-scrollable")
-        except NoSuchElementException:
-            try:
-                move_list_elem = self.chrome.find_element(By.CLASS_NAME, "mode-swap-move-list-wrapper-component")
-            except NoSuchElementException:
-                    return None
+    def snapshot(self):
+        return self.call_page_function("__chessBotSnapshot", SNAPSHOT_SCRIPT)
 
-        # Select all children with class containing "white node" or "black node"
-        # Moves that are not pawn moves have a different structure
-        # containing children
-        if not self.moves_list:
-            # If the moves list is empty, find all moves
-            moves = move_list_elem.find_elements(By.CSS_SELECTOR, "div.node[data-node]")
-        else:
-            # If the moves list is not empty, find only the new moves
-            moves = move_list_elem.find_elements(By.CSS_SELECTOR, "div.node[data-node]:not([data-processed])")
-
-        for move in moves:
-            move_class = move.get_attribute("class")
-
-            # Check if it is indeed a move
-            if "white-move" in move_class or "black-move" in move_class:
-                # Check if it has a figure - search deeper in the structure
-                try:
-                    # Look for any element with data-figurine attribute anywhere within this move
-                    figurine_elem = move.find_element(By.CSS_SELECTOR, "[data-figurine]")
-                    figure = figurine_elem.get_attribute("data-figurine")
-                except NoSuchElementException:
-                    figure = None
-
-                # Check if it was en-passant or figure-move
-                if figure is None:
-                    # If the moves_list is empty or the last move was not the current move
-                    self.moves_list[move.get_attribute("data-node")] = move.text
-                elif "=" in move.text:
-                    m = move.text + figure
-                    # If the move is a check, add the + in the end
-                    if "+" in m:
-                        m = m.replace("+", "")
-                        m += "+"
-
-                    # If the moves_list is empty or the last move was not the current move
-                    self.moves_list[move.get_attribute("data-node")] = m
-                else:
-                    # If the moves_list is empty or the last move was not the current move
-                    self.moves_list[move.get_attribute("data-node")] = figure + move.text
-
-                # Mark the move as processed
-                self.chrome.execute_script("arguments[0].setAttribute('data-processed', 'true')", move)
-
-        return list(self.moves_list.values())
-
-    def is_game_puzzles(self):
-        return False
+    def get_watched_selectors(self):
+        return [
+            ".play-controller-scrollable",
+            ".mode-swap-move-list-wrapper-component",
+            ".board-modal-container",
+        ]
 
     def click_puzzle_next(self):
         pass
@@ -125,3 +114,6 @@ class ChesscomGrabber(Grabber):
 
     def make_mouseless_move(self, move, move_count):
         pass
+
+    def reset_game_state(self):
+        self.invalidate_geometry()
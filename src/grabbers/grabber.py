@@ -1,50 +1,313 @@
 from abc import ABC, abstractmethod
 
-from utilities import attach_to_session
+from selenium.common import WebDriverException
+
+import tracing
+from utilities import attach_to_session, char_to_num
+
+
+# Installs (once per page) MutationObservers on the elements matched by the
+# given CSS selectors and bumps a version counter whenever their class,
+# children or text change. Only those elements are observed (not the whole
+# document), so the clocks and everything else on the page cost nothing.
+# The selectors are resolved again every RESOLVE_INTERVAL milliseconds (and
+# on every call), and the observers moved when an element appears, is
+# replaced or goes away, which also counts as a change. The script then
+# blocks until the version differs from the one the caller has already seen
+# or until the timeout passes, and returns the current version.
+# Arguments: watched CSS selectors, last seen version, timeout in milliseconds
+WAIT_FOR_CHANGE_SCRIPT = """
+var watchedSelectors = arguments[0];
+var lastVersion = arguments[1];
+var timeout = arguments[2];
+var done = arguments[arguments.length - 1];
+var RESOLVE_INTERVAL = 200;
+
+var state = window.__chessBotObserver;
+if (!state) {
+    state = window.__chessBotObserver = {
+        token: Math.random().toString(36).slice(2),
+        counter: 0,
+        waiters: [],
+        selectors: watchedSelectors,
+        nodes: [],
+        observers: []
+    };
+    state.signature = function () {
+        return state.nodes.map(function (node) {
+            if (!node) {
+                return "-";
+            }
+            return node.getAttribute("class") + ":" + node.childElementCount + ":" + node.textContent.length;
+        }).join("|");
+    };
+    state.version = function () {
+        return state.token + ":" + state.counter;
+    };
+    state.changed = function () {
+        var signature = state.signature();
+        if (signature === state.lastSignature) {
+            return;
+        }
+        state.lastSignature = signature;
+        state.counter++;
+        var waiters = state.waiters;
+        state.waiters = [];
+        waiters.forEach(function (waiter) { waiter(); });
+    };
+    // Observes the elements the selectors match now, if they are not the observed ones
+    state.attach = function () {
+        var nodes = state.selectors.map(function (selector) {
+            var node = document.querySelector(selector);
+            return node && node.isConnected ? node : null;
+        });
+        var same = nodes.length === state.nodes.length && nodes.every(function (node, i) {
+            return node === state.nodes[i];
+        });
+        if (same) {
+            return;
+        }
+        state.observers.forEach(function (observer) { observer.disconnect(); });
+        state.nodes = nodes;
+        state.observers = nodes.filter(function (node) { return node; }).map(function (node) {
+            var observer = new MutationObserver(state.changed);
+            observer.observe(node, {
+                childList: true,
+                subtree: true,
+                characterData: true,
+                attributes: true,
+                attributeFilter: ["class"]
+            });
+            return observer;
+        });
+        state.changed();
+    };
+    state.attach();
+    setInterval(state.attach, RESOLVE_INTERVAL);
+}
+state.selectors = watchedSelectors;
+state.attach();
+
+if (state.version() !== lastVersion) {
+    done(state.version());
+    return;
+}
+
+var finished = false;
+var finish = function () {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    state.waiters = state.waiters.filter(function (waiter) { return waiter !== finish; });
+    done(state.version());
+};
+state.waiters.push(finish);
+setTimeout(finish, timeout);
+"""
+
+# Helper functions shared by the snapshot scripts of all grabbers
+SNAPSHOT_HELPERS_SCRIPT = """
+var findByXpath = function (xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+};
+var getBoardRect = function (boardElem) {
+    if (!boardElem) {
+        return null;
+    }
+    var rect = boardElem.getBoundingClientRect();
+    return {
+        x: rect.left + window.scrollX,
+        y: rect.top + window.scrollY,
+        width: rect.width,
+        height: rect.height
+    };
+};
+// Reads a clock element (Ex. "1:23", "00:09.5", "1:02:03")
+// Returns the remaining time in seconds, null if not found
+var parseClock = function (clockElem) {
+    if (!clockElem) {
+        return null;
+    }
+    var match = clockElem.textContent.match(/\d+(?::\d+)+(?:\.\d+)?/);
+    if (!match) {
+        return null;
+    }
+    return match[0].split(":").reduce(function (total, part) {
+        return total * 60 + parseFloat(part);
+    }, 0);
+};
+var getWindowOffset = function () {
+    return {
+        x: window.screenX + (window.outerWidth - window.innerWidth) / 2 - window.scrollX,
+        y: window.screenY + (window.outerHeight - window.innerHeight) - window.scrollY
+    };
+};
+// Returns a value that only changes when the page is reloaded, resized,
+// scrolled or when the browser window is moved on the screen
+var getGeometryVersion = function () {
+    var geometry = window.__chessBotGeometry;
+    if (!geometry) {
+        geometry = window.__chessBotGeometry = {
+            token: Math.random().toString(36).slice(2),
+            counter: 0
+        };
+        var invalidate = function () {
+            geometry.counter++;
+        };
+        window.addEventListener("resize", invalidate, {passive: true});
+        window.addEventListener("scroll", invalidate, {passive: true, capture: true});
+    }
+    return geometry.token + ":" + geometry.counter + ":" + window.screenX + ":" + window.screenY;
+};
+"""
+
+GEOMETRY_VERSION_SCRIPT = SNAPSHOT_HELPERS_SCRIPT + """
+return getGeometryVersion();
+"""
+
+# Calls the function kept in the page under the name given as the first
+# argument with the other arguments (see Grabber.call_page_function)
+# Returns [result], null if the page doesn't have the function
+PAGE_FUNCTION_SCRIPT = (
+    "var f = window[arguments[0]];"
+    "return f ? [f.apply(null, Array.prototype.slice.call(arguments, 1))] : null;"
+)
 
 
 # Base abstract class for different chess sites
 class Grabber(ABC):
     def __init__(self, chrome_url, chrome_session_id):
-        self.chrome = attach_to_session(chrome_url, chrome_session_id)
-        self._board_elem = None
+        # Grabbers that don't read a browser page (Ex. ReplayGrabber) pass no session
+        self.chrome = attach_to_session(chrome_url, chrome_session_id) if chrome_url is not None else None
 
-    def get_board(self):
-        return self._board_elem
+        # Number of WebDriver commands sent so far
+        self.webdriver_calls = 0
+        if self.chrome is not None:
+            executor = self.chrome.command_executor
+            original_execute = executor.execute
 
-    # Returns the coordinates of the top left corner of the ChromeDriver
-    def get_top_left_corner(self):
-        canvas_x_offset = self.chrome.execute_script("return window.screenX + (window.outerWidth - window.innerWidth) / 2 - window.scrollX;")
-        canvas_y_offset = self.chrome.execute_script("return window.screenY + (window.outerHeight - window.innerHeight) - window.scrollY;")
-        return canvas_x_offset, canvas_y_offset
+            def execute(command, params=None):
+                self.webdriver_calls += 1
+                with tracing.span(command, "webdriver"):
+                    return original_execute(command, params)
 
-    # Sets the _board_elem variable
-    @abstractmethod
-    def update_board_elem(self):
-        pass
+            executor.execute = execute
+        self._observer_version = None
 
-    # Returns True if white, False if black,
-    # None if the color is not found
-    @abstractmethod
-    def is_white(self):
-        pass
+        # Screen coordinates of the center of every square for both board
+        # orientations, rebuilt only when the board geometry changes
+        # Ex. self._square_positions[True]["e4"] -> (x, y) when playing white
+        self._square_positions = None
+        self._board_rect = None
+        self._geometry_version = None
 
-    # Checks if the game over window popup is open
-    # Returns True if it is, False if it isn't
-    @abstractmethod
-    def is_game_over(self):
-        pass
+    # Rebuilds the square positions table from a snapshot()
+    # result if the board geometry has changed since the last one
+    def update_geometry(self, state):
+        if state["board"] is None or state["geometry_version"] == self._geometry_version:
+            return
 
-    # Returns the current board move list
-    # Ex. ["e4", "c5", "Nf3"]
+        # Get the absolute board position and the square size
+        board_x = state["offset"]["x"] + state["board"]["x"]
+        board_y = state["offset"]["y"] + state["board"]["y"]
+        square_size = state["board"]["width"] / 8
+
+        # Depending on the player color, the board is flipped, so the coordinates need to be adjusted
+        positions = {True: {}, False: {}}
+        for file in "abcdefgh":
+            for rank in range(1, 9):
+                square = file + str(rank)
+                positions[True][square] = (
+                    board_x + square_size * (char_to_num(file) - 1) + square_size / 2,
+                    board_y + square_size * (8 - rank) + square_size / 2
+                )
+                positions[False][square] = (
+                    board_x + square_size * (8 - char_to_num(file)) + square_size / 2,
+                    board_y + square_size * (rank - 1) + square_size / 2
+                )
+
+        self._square_positions = positions
+        self._board_rect = (int(board_x), int(board_y), int(state["board"]["width"]), int(state["board"]["height"]))
+        self._geometry_version = state["geometry_version"]
+
+    # Makes sure the square positions table is up to date. This costs a single
+    # small script unless the page was resized or scrolled since the last snapshot
+    def refresh_geometry(self):
+        with tracing.span("refresh_geometry", "grabber"):
+            if self.chrome.execute_script(GEOMETRY_VERSION_SCRIPT) != self._geometry_version:
+                self.update_geometry(self.snapshot())
+
+    # Forgets the board geometry, so that the next snapshot rebuilds it
+    def invalidate_geometry(self):
+        self._geometry_version = None
+
+    # Returns the screen rectangle of the board as (x, y, width, height)
+    def get_board_rect(self):
+        return self._board_rect
+
+    # Converts a square to screen coordinates using the cached table
+    # Example: "a1" -> (x, y)
+    def square_to_screen_pos(self, square, is_white):
+        return self._square_positions[is_white][square]
+
+    # Blocks until one of the watched elements (move list, game over window)
+    # changes on the page or until the timeout (in seconds) passes.
+    # Returns True if something changed, False on timeout
+    def wait_for_change(self, timeout=1.0):
+        try:
+            with tracing.span("wait_for_change", "grabber"):
+                version = self.chrome.execute_async_script(
+                    WAIT_FOR_CHANGE_SCRIPT, self.get_watched_selectors(), self._observer_version, int(timeout * 1000)
+                )
+        except WebDriverException:
+            # The page was probably reloaded while waiting,
+            # so let the caller look at the new page
+            self._observer_version = None
+            return True
+
+        changed = version != self._observer_version
+        self._observer_version = version
+        return changed
+
+    # Calls a function that is kept in the page (window[name]).
+    # The function source is only sent (and compiled by the browser)
+    # the first time or after the page has been reloaded, every other
+    # call is a single short execute_script
+    def call_page_function(self, name, source, *args):
+        with tracing.span(name, "grabber"):
+            result = self.chrome.execute_script(PAGE_FUNCTION_SCRIPT, name, *args)
+            if result is not None:
+                return result[0]
+
+            return self.chrome.execute_script(
+                "window[" + repr(name) + "] = function () {" + source + "};"
+                "return window[" + repr(name) + "].apply(null, arguments);",
+                *args
+            )
+
+    # Returns the whole board state in a single round trip as a dict:
+    # - "moves": the move list (Ex. ["e4", "c5", "Nf3"]), None if not found
+    # - "is_white": True if white, False if black, None if not found
+    # - "is_puzzles": True if the player does puzzles
+    # - "is_game_over": True if the game over window is open
+    # - "board": the board rect {"x", "y", "width", "height"} relative
+    #   to the page, None if the board is not found
+    # - "offset": the screen coordinates {"x", "y"} of the top left
+    #   corner of the page (taking the browser window and the scrolling into account)
+    # - "geometry_version": changes whenever "board" or "offset" may have changed
+    # - "clock": the remaining time of the player and the opponent and the increment
+    #   {"player", "opponent", "increment"} in seconds, "player" and "opponent"
+    #   are None if the clocks are not found (Ex. puzzles)
     @abstractmethod
-    def get_move_list(self):
+    def snapshot(self):
         pass
 
-    # Returns True if the player does puzzles
-    # and False if not
+    # Returns the CSS selectors of the elements whose changes
+    # should wake up wait_for_change(). They should be anchored
+    # (Ex. by an id or a class), as they are resolved several times a second
     @abstractmethod
-    def is_game_puzzles(self):
+    def get_watched_selectors(self):
         pass
 
     # Clicks the next button on the puzzles page
@@ -56,3 +319,9 @@ class Grabber(ABC):
     @abstractmethod
     def make_mouseless_move(self, move, move_count):
         pass
+
+    # Clears any per-game state so that the grabber
+    # can be reused for the next game
+    @abstractmethod
+    def reset_game_state(self):
+        pass
@@ -1,166 +1,124 @@
-import re
-
 from selenium.common import NoSuchElementException, StaleElementReferenceException
 from selenium.webdriver.common.by import By
 
-from grabbers.grabber import Grabber
+from grabbers.grabber import Grabber, SNAPSHOT_HELPERS_SCRIPT
+
+# Reads the board, the player color, the game over window, the puzzle
+# mode, the move list and the clocks from the page (see Grabber.snapshot)
+# Arguments: the cached tag name of the normal move list moves (or null)
+SNAPSHOT_SCRIPT = SNAPSHOT_HELPERS_SCRIPT + """
+var tagName = arguments[0];
+
+var boardElem = findByXpath('//*[@id="main-wrap"]/main/div[1]/div[1]/div/cg-container') ||
+    findByXpath('/html/body/div[2]/main/div[1]/div/cg-container');
+
+// Get "ranks" child
+var isWhite = null;
+if (boardElem) {
+    for (var i = 0; i < boardElem.children.length; i++) {
+        var childClass = boardElem.children[i].getAttribute("class") || "";
+        if (childClass.indexOf("ranks") !== -1) {
+            isWhite = childClass === "ranks";
+            break;
+        }
+    }
+}
+
+var isPuzzles = findByXpath("/html/body/div[2]/main/aside/div[1]/div[1]/div/p[1]") !== null;
+
+var isGameOver = findByXpath('//*[@id="main-wrap"]/main/aside/div/section[2]') !== null;
+if (!isGameOver) {
+    var puzzleGameOverWindow = findByXpath("/html/body/div[2]/main/div[2]/div[3]/div[1]");
+    isGameOver = puzzleGameOverWindow !== null && puzzleGameOverWindow.getAttribute("class") === "complete";
+}
+
+// Read the move list
+var moves = null;
+var children = null;
+if (isPuzzles) {
+    var puzzlesMoveListElem = findByXpath("/html/body/div[2]/main/div[2]/div[2]/div");
+    if (puzzlesMoveListElem) {
+        children = puzzlesMoveListElem.querySelectorAll("move");
+    }
+} else {
+    var moveListElem = findByXpath('//*[@id="main-wrap"]/main/div[1]/rm6/l4x');
+    if (moveListElem) {
+        if (tagName === null && moveListElem.lastElementChild) {
+            tagName = moveListElem.lastElementChild.tagName.toLowerCase();
+        }
+        children = tagName === null ? [] : moveListElem.querySelectorAll(tagName);
+    } else if (findByXpath('//*[@id="main-wrap"]/main/div[1]/rm6')) {
+        // There are no moves yet
+        children = [];
+    }
+}
+if (children !== null) {
+    moves = [];
+    for (var j = 0; j < children.length; j++) {
+        // Sanitize the move
+        var move = children[j].innerText.replace(/[^a-zA-Z0-9+-]/g, "");
+        if (move !== "") {
+            moves.push(move);
+        }
+    }
+}
+
+// Read the clocks (the player's clock is at the bottom)
+// and the increment from the time control (Ex. "3+2")
+var clock = {
+    player: parseClock(document.querySelector(".rclock-bottom .time")),
+    opponent: parseClock(document.querySelector(".rclock-top .time")),
+    increment: 0
+};
+var setupElem = document.querySelector(".game__meta .setup");
+var timeControl = setupElem ? setupElem.textContent.match(/\+(\d+)/) : null;
+if (timeControl) {
+    clock.increment = parseInt(timeControl[1], 10);
+}
+
+return {
+    moves: moves,
+    is_white: isWhite,
+    is_puzzles: isPuzzles,
+    is_game_over: isGameOver,
+    board: getBoardRect(boardElem),
+    offset: getWindowOffset(),
+    geometry_version: getGeometryVersion(),
+    clock: clock,
+    tag_name: tagName
+};
+"""
 
 
 class LichessGrabber(Grabber):
     def __init__(self, chrome_url, chrome_session_id):
         super().__init__(chrome_url, chrome_session_id)
         self.tag_name = None
-        self.moves_list = {}
-
-    def update_board_elem(self):
-        # Keep looking for board
-        while True:
-            try:
-                # Try finding the normal board
-                self._board_elem = self.chrome.find_element(By.XPATH,
-                                                            '//*[@id="main-wrap"]/main/div[1]/div[1]/div/cg-container')
-                return
-            except NoSuchElementException:
-                try:
-                    # Try finding the board in the puzzles page
-                    self._board_elem = self.chrome.find_element(By.XPATH, '/html/body/div[2]/main/div[1]/div/cg-container')
-                    return
-                except NoSuchElementException:
-                    self._board_elem = None
-
-    def is_white(self):
-        # sourcery skip: assign-if-exp, boolean-if-exp-identity, remove-unnecessary-cast
-        # Get "ranks" child
-        children = self._board_elem.find_elements(By.XPATH, "./*")
-        child = [x for x in children if "ranks" in x.get_attribute("class")][0]
-        if child.get_attribute("class") == "ranks":
-            return True
-        else:
-            return False
-
-    def is_game_over(self):
-        # sourcery skip: assign-if-exp, boolean-if-exp-identity, reintroduce-else, remove-unnecessary-cast
-        try:
-            # Find the game over window
-            self.chrome.find_element(By.XPATH, '//*[@id="main-wrap"]/main/aside/div/section[2]')
-
-            # If we don't have an exception at this point, we have found the game over window
-            return True
-        except NoSuchElementException:
-            # Try finding the puzzles game over window and checking its class
-            try:
-                # The game over window
-                game_over_window = self.chrome.find_element(By.XPATH, '/html/body/div[2]/main/div[2]/div[3]/div[1]')
-
-                if game_over_window.get_attribute("class") == "complete":
-                    return True
-
-                # If we don't have an exception at this point and the window's class is not "complete",
-                # then the game is still going
-                return False
-            except NoSuchElementException:
-                return False
 
-    def set_moves_tag_name(self):
-        if self.is_game_puzzles():
-            return False
-
-        move_list_elem = self.get_normal_move_list_elem()
-
-        if move_list_elem is None or move_list_elem == []:
-            return False
-
-        try:
-            last_child = move_list_elem.find_element(By.XPATH, "*[last()]")
-            self.tag_name = last_child.tag_name
-
-            return True
-        except NoSuchElementException:
-            return False
-
-    def get_move_list(self):
-        # sourcery skip: assign-if-exp, merge-else-if-into-elif, use-fstring-for-concatenation
-        is_puzzles = self.is_game_puzzles()
-
-        # Find the move list element
-        if is_puzzles:
-            move_list_elem = self.get_puzzles_move_list_elem()
-
-            if move_list_elem is None:
-                return None
-        else:
-            move_list_elem = self.get_normal_move_list_elem()
-
-            if move_list_elem is None:
-                return None
-            if (not move_list_elem) or (self.tag_name is None and self.set_moves_tag_name() is False):
-                return []
-
-        # Get the move elements (children of the move list element)
-        try:
-            if not is_puzzles:
-                if not self.moves_list:
-                    # If the moves list is empty, find all moves
-                    children = move_list_elem.find_elements(By.CSS_SELECTOR, self.tag_name)
-                else:
-                    # If the moves list is not empty, find only the new moves
-                    children = move_list_elem.find_elements(By.CSS_SELECTOR, self.tag_name + ":not([data-processed])")
-            else:
-                if not self.moves_list:
-                    # If the moves list is empty, find all moves
-                    children = move_list_elem.find_elements(By.CSS_SELECTOR, "move")
-                else:
-                    # If the moves list is not empty, find only the new moves
-                    children = move_list_elem.find_elements(By.CSS_SELECTOR, "move:not([data-processed])")
-        except NoSuchElementException:
-            return None
-
-        # Get the moves from the elements
-        for move_element in children:
-            # Sanitize the move
-            move = re.sub(r"[^a-zA-Z0-9+-]", "", move_element.text)
-            if move != "":
-                self.moves_list[move_element.id] = move
-
-            # Mark the move as processed
-            self.chrome.execute_script("arguments[0].setAttribute('data-processed', 'true')", move_element)
-
-        return [val for val in self.moves_list.values()]
-
-    def get_puzzles_move_list_elem(self):
-        try:
-            # Try finding the move list in the puzzles page
-            move_list_elem = self.chrome.find_element(By.XPATH, '/html/body/div[2]/main/div[2]/div[2]/div')
-
-            return move_list_elem
-        except NoSuchElementException:
-            return None
-
-    def get_normal_move_list_elem(self):
-        try:
-            # Try finding the normal move list
-            move_list_elem = self.chrome.find_element(By.XPATH, '//*[@id="main-wrap"]/main/div[1]/rm6/l4x')
-
-            return move_list_elem
-        except NoSuchElementException:
-            try:
-                # Try finding the normal move list when there are no moves yet
-                self.chrome.find_element(By.XPATH, '//*[@id="main-wrap"]/main/div[1]/rm6')
-
-                # If we don't have an exception at this point, we don't have any moves yet
-                return []
-            except NoSuchElementException:
-                return None
-
-    def is_game_puzzles(self):
-        try:
-            # Try finding the puzzles text
-            self.chrome.find_element(By.XPATH, "/html/body/div[2]/main/aside/div[1]/div[1]/div/p[1]")
-
-            # If we don't have an exception at this point, the game is a puzzle
-            return True
-        except NoSuchElementException:
-            return False
+    def snapshot(self):
+        state = self.call_page_function("__chessBotSnapshot", SNAPSHOT_SCRIPT, self.tag_name)
+
+        # Remember the tag name of the moves, so that the result
+        # line added when the game ends is not mistaken for a move.
+        # Not while the game is over, as the last child can then be the result
+        # (Ex. the finished game is still shown right after a reset_game_state)
+        tag_name = state.pop("tag_name")
+        if self.tag_name is None and not state["is_game_over"]:
+            self.tag_name = tag_name
+
+        return state
+
+    def get_watched_selectors(self):
+        return [
+            # Normal move list (also shows the result when the game ends)
+            "#main-wrap > main > div:nth-of-type(1) > rm6",
+            # Puzzles move list
+            "body > div:nth-of-type(2) > main > div:nth-of-type(2) > div:nth-of-type(2) > div",
+            # Game over window
+            "#main-wrap > main > aside > div > section:nth-of-type(2)",
+            # Puzzles game over window
+            "body > div:nth-of-type(2) > main > div:nth-of-type(2) > div:nth-of-type(3) > div:nth-of-type(1)",
+        ]
 
     def click_puzzle_next(self):
         # Find the next continue training button
@@ -191,3 +149,7 @@ class LichessGrabber(Grabber):
         message = '{"t":"move","d":{"u":"' + move + '","b":1,"a":' + str(move_count) + '}}'
         script = 'lichess.socket.ws.send(JSON.stringify(' + message + '))'
         self.chrome.execute_script(script)
+
+    def reset_game_state(self):
+        self.tag_name = None
+        self.invalidate_geometry()
@@ -0,0 +1,112 @@
+import random
+import time
+
+import chess
+
+from grabbers.grabber import Grabber
+
+
+# Grabber that plays against a game from a PGN file instead of a browser page.
+# The page is kept in memory: the opponent plays the moves of the game
+# (a random legal move once the bot has left the game), each one showing up
+# opponent_delay seconds after the bot's move, and the bot's mouseless moves
+# are played on it directly. The board has a fixed size at the top left
+# corner of the screen. Used to benchmark the bot without Chrome or a site
+class ReplayGrabber(Grabber):
+    def __init__(self, game, is_white, opponent_delay=0.1, seed=0):
+        super().__init__(None, None)
+        self.game = game
+        self.player_is_white = is_white
+        self.opponent_delay = opponent_delay
+        self.random = random.Random(seed)
+
+        # The moves of the game, and the number of plies after which it ends
+        self.game_moves = list(game.mainline_moves())
+        self.max_plies = len(self.game_moves)
+
+        # Timestamps (time.perf_counter()) of every move of the bot:
+        # "shown": when the opponent's move before it showed up on the page
+        # (None for the first move of the game when the bot plays white),
+        # "seen": when the bot first read the page after that,
+        # "acted": when the bot played its move
+        self.timeline = []
+
+        self.reset_game_state()
+
+    # Plays the opponent's move if its time has come
+    # Returns True if it did
+    def _advance(self):
+        if self._reply_at is None or time.perf_counter() < self._reply_at:
+            return False
+
+        ply = len(self.board.move_stack)
+        move = self.game_moves[ply] if ply < len(self.game_moves) else None
+        if move is None or not self.board.is_legal(move):
+            move = self.random.choice(list(self.board.legal_moves))
+        self.moves.append(self.board.san(move))
+        self.board.push(move)
+
+        self._reply_at = None
+        self._shown_at = time.perf_counter()
+        self._seen_at = None
+        return True
+
+    # Schedules the opponent's move if it is the opponent's turn
+    def _schedule_reply(self, delay):
+        if not self._is_over() and self.board.turn != self.player_is_white:
+            self._reply_at = time.perf_counter() + delay
+
+    def _is_over(self):
+        return self.board.is_game_over() or len(self.board.move_stack) >= self.max_plies
+
+    def snapshot(self):
+        self._advance()
+        if self._seen_at is None:
+            self._seen_at = time.perf_counter()
+
+        return {
+            "moves": list(self.moves),
+            "is_white": self.player_is_white,
+            "is_puzzles": False,
+            "is_game_over": self._is_over(),
+            "board": {"x": 0, "y": 0, "width": 800, "height": 800},
+            "offset": {"x": 0, "y": 0},
+            "geometry_version": "replay",
+            "clock": {"player": None, "opponent": None, "increment": 0},
+        }
+
+    def get_watched_selectors(self):
+        return []
+
+    # The board never moves
+    def refresh_geometry(self):
+        pass
+
+    def wait_for_change(self, timeout=1.0):
+        if self._reply_at is not None:
+            time.sleep(max(0.0, min(timeout, self._reply_at - time.perf_counter())))
+        else:
+            time.sleep(timeout)
+        return self._advance()
+
+    def click_puzzle_next(self):
+        pass
+
+    def make_mouseless_move(self, move, move_count):
+        self.timeline.append({"shown": self._shown_at, "seen": self._seen_at, "acted": time.perf_counter()})
+
+        move = chess.Move.from_uci(move)
+        self.moves.append(self.board.san(move))
+        self.board.push(move)
+        self._schedule_reply(self.opponent_delay)
+
+    def reset_game_state(self):
+        self.board = chess.Board()
+        self.moves = []
+        self._reply_at = None
+        self._shown_at = None
+        self._seen_at = None
+        self.invalidate_geometry()
+
+        # The opponent's first move shows up right away when the bot plays black
+        self._schedule_reply(0)
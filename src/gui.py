@@ -1,18 +1,34 @@
-import os
+import time
+
+# Measured before anything else is imported (see --profile-startup)
+IMPORTS_STARTED = time.perf_counter()
+
+import argparse
+import collections
+import json
+import sys
 
-import multiprocess
 import threading
-import time
+import traceback
 import tkinter as tk
 from tkinter import ttk, filedialog
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.service import Service as ChromeService
-from overlay import run
-from stockfish_bot import StockfishBot
-from selenium.common import WebDriverException
-import keyboard
+import messages
+from move_list import MoveList, MoveListView
+from eval_graph import EvalGraph
+from metrics import Metrics, MetricsServer, summarize
+import tracing
+
+# The heavy modules (selenium, webdriver_manager, multiprocess, chess, PyQt6,
+# pyautogui, keyboard) are imported when they are first needed (Open Browser,
+# Start, the keyboard shortcuts, the overlay process), so that the window shows quickly.
+# --profile-startup reports any of them that got imported before the window showed
+DEFERRED_MODULES = ["selenium", "webdriver_manager", "multiprocess", "chess", "PyQt6", "pyautogui", "keyboard"]
+
+
+# Runs the overlay (in its own process), PyQt6 is only imported there
+def run_overlay(command_queue, pipe):
+    from overlay import run
+    run(command_queue, pipe)
 
 
 class GUI:
@@ -35,13 +51,30 @@ class GUI:
         self.stockfish_bot_pipe = None
         self.overlay_screen_pipe = None
 
+        # Set when a new Stockfish Bot pipe is created, so that
+        # the process communicator thread starts waiting on it
+        self.stockfish_bot_pipe_ready = threading.Event()
+
         # The Stockfish Bot process
         self.stockfish_bot_process = None
+
+        # The overlay process and the queue of its commands (see messages.OVERLAY_*)
+        # It is started the first time the bot starts and kept until the GUI closes
         self.overlay_screen_process = None
-        self.restart_after_stopping = False
+        self.overlay_queue = None
 
         # Used for storing the match moves
-        self.match_moves = []
+        self.match_moves = MoveList()
+
+        # The latency histograms of the GUI, and the last ones
+        # received from the other processes (Ex. {"bot": ..., "overlay": ...})
+        self.metrics = Metrics()
+        self.process_metrics = {}
+        self.metrics_server = None
+        self.stats_window = None
+
+        # The spans received from the other processes while tracing (see tracing.py)
+        self.trace_events = collections.deque(maxlen=200000)
 
         # Set the window properties
         master.title("Chess")
@@ -159,6 +192,26 @@ class GUI:
         self.mouse_latency_scale.pack()
         mouse_latency_frame.pack(anchor=tk.NW)
 
+        # Create the mouse input radio buttons
+        # The XTest input sends the mouse events straight to the X server, so it is only available on Linux
+        self.input_backend = tk.StringVar(value="pyautogui")
+        if sys.platform.startswith("linux"):
+            input_backend_frame = tk.Frame(left_frame)
+            tk.Label(input_backend_frame, text="Mouse Input").pack(side=tk.LEFT)
+            tk.Radiobutton(
+                input_backend_frame,
+                text="PyAutoGUI",
+                variable=self.input_backend,
+                value="pyautogui"
+            ).pack(side=tk.LEFT)
+            tk.Radiobutton(
+                input_backend_frame,
+                text="XTest",
+                variable=self.input_backend,
+                value="xtest"
+            ).pack(side=tk.LEFT)
+            input_backend_frame.pack(anchor=tk.NW)
+
         # Separator
         separator_frame = tk.Frame(left_frame)
         separator = ttk.Separator(separator_frame, orient="horizontal")
@@ -206,6 +259,20 @@ class GUI:
         self.stockfish_depth_scale.pack()
         stockfish_depth_frame.pack(anchor=tk.NW)
 
+        # Create the MultiPV scale
+        multipv_frame = tk.Frame(left_frame)
+        tk.Label(multipv_frame, text="Candidate Moves").pack(side=tk.LEFT, pady=(19, 0))
+        self.multipv = tk.IntVar(value=1)
+        self.multipv_scale = tk.Scale(
+            multipv_frame,
+            from_=1,
+            to=5,
+            orient=tk.HORIZONTAL,
+            variable=self.multipv,
+        )
+        self.multipv_scale.pack()
+        multipv_frame.pack(anchor=tk.NW)
+
         # Create the memory entry field
         memory_frame = tk.Frame(left_frame)
         tk.Label(memory_frame, text="Memory").pack(side=tk.LEFT)
@@ -227,6 +294,87 @@ class GUI:
         self.cpu_threads_entry.pack()
         cpu_threads_frame.pack(anchor=tk.NW)
 
+        # Create the clock check button
+        self.enable_clock = tk.IntVar(value=0)
+        self.clock_check_button = tk.Checkbutton(
+            left_frame,
+            text="Manage time from the clock",
+            variable=self.enable_clock
+        )
+        self.clock_check_button.pack(anchor=tk.NW)
+
+        # Create the clock safety margin entry field
+        clock_margin_frame = tk.Frame(left_frame)
+        tk.Label(clock_margin_frame, text="Safety Margin").pack(side=tk.LEFT)
+        self.clock_margin = tk.IntVar(value=100)
+        self.clock_margin_entry = tk.Entry(
+            clock_margin_frame, textvariable=self.clock_margin, justify="center", width=7
+        )
+        self.clock_margin_entry.pack(side=tk.LEFT)
+        tk.Label(clock_margin_frame, text="ms").pack()
+        clock_margin_frame.pack(anchor=tk.NW)
+
+        # Create the analysis cache check button
+        self.enable_analysis_cache = tk.IntVar(value=0)
+        self.analysis_cache_check_button = tk.Checkbutton(
+            left_frame,
+            text="Analysis cache (skill level 20 only)",
+            variable=self.enable_analysis_cache
+        )
+        self.analysis_cache_check_button.pack(anchor=tk.NW)
+
+        # Create the analysis cache statistics text
+        self.analysis_cache_text = tk.Label(left_frame, text="Cache hits: 0, misses: 0")
+        self.analysis_cache_text.pack(anchor=tk.NW)
+
+        # Separator
+        separator_frame = tk.Frame(left_frame)
+        separator = ttk.Separator(separator_frame, orient="horizontal")
+        separator.grid(row=0, column=0, sticky="ew")
+        label = tk.Label(separator_frame, text="Opening book")
+        label.grid(row=0, column=0, padx=52)
+        separator_frame.pack(anchor=tk.NW, pady=10, expand=True, fill=tk.X)
+
+        # Create the book selection radio buttons
+        self.book_selection = tk.StringVar(value="best")
+        self.book_best_radio_button = tk.Radiobutton(
+            left_frame,
+            text="Best move",
+            variable=self.book_selection,
+            value="best"
+        )
+        self.book_best_radio_button.pack(anchor=tk.NW)
+        self.book_random_radio_button = tk.Radiobutton(
+            left_frame,
+            text="Weighted random move",
+            variable=self.book_selection,
+            value="random"
+        )
+        self.book_random_radio_button.pack(anchor=tk.NW)
+
+        # Create the book max ply entry field
+        book_max_ply_frame = tk.Frame(left_frame)
+        tk.Label(book_max_ply_frame, text="Max Ply").pack(side=tk.LEFT)
+        self.book_max_ply = tk.IntVar(value=20)
+        self.book_max_ply_entry = tk.Entry(
+            book_max_ply_frame, textvariable=self.book_max_ply, justify="center", width=8
+        )
+        self.book_max_ply_entry.pack()
+        book_max_ply_frame.pack(anchor=tk.NW)
+
+        # Create the select book button
+        self.book_path = ""
+        self.select_book_button = tk.Button(
+            left_frame,
+            text="Select Book",
+            command=self.on_select_book_button_listener,
+        )
+        self.select_book_button.pack(anchor=tk.NW)
+
+        # Create the book path text
+        self.book_path_text = tk.Label(left_frame, text="", wraplength=180)
+        self.book_path_text.pack(anchor=tk.NW)
+
         # Separator
         separator_frame = tk.Frame(left_frame)
         separator = ttk.Separator(separator_frame, orient="horizontal")
@@ -247,6 +395,45 @@ class GUI:
         )
         self.topmost_check_button.pack(anchor=tk.NW)
 
+        # Create the metrics server check button and port entry field
+        metrics_server_frame = tk.Frame(left_frame)
+        self.enable_metrics_server = tk.IntVar(value=0)
+        self.metrics_server_check_button = tk.Checkbutton(
+            metrics_server_frame,
+            text="Serve metrics on port",
+            variable=self.enable_metrics_server,
+            command=self.on_metrics_server_check_button_listener,
+        )
+        self.metrics_server_check_button.pack(side=tk.LEFT)
+        self.metrics_server_port = tk.IntVar(value=9464)
+        self.metrics_server_port_entry = tk.Entry(
+            metrics_server_frame, textvariable=self.metrics_server_port, justify="center", width=6
+        )
+        self.metrics_server_port_entry.pack()
+        metrics_server_frame.pack(anchor=tk.NW)
+
+        # Create the tracing check button
+        self.enable_tracing = tk.IntVar(value=0)
+        self.tracing_check_button = tk.Checkbutton(
+            left_frame,
+            text="Trace the game loop",
+            variable=self.enable_tracing,
+            command=self.on_tracing_check_button_listener,
+        )
+        self.tracing_check_button.pack(anchor=tk.NW)
+
+        # Create the show stats button
+        self.show_stats_button = tk.Button(
+            left_frame, text="Show Stats", command=self.on_show_stats_button_listener
+        )
+        self.show_stats_button.pack(anchor=tk.NW)
+
+        # Create the export trace button
+        self.export_trace_button = tk.Button(
+            left_frame, text="Export Trace", command=self.on_export_trace_button_listener
+        )
+        self.export_trace_button.pack(anchor=tk.NW)
+
         # Create the select stockfish button
         self.stockfish_path = ""
         self.select_stockfish_button = tk.Button(
@@ -260,6 +447,19 @@ class GUI:
         self.stockfish_path_text = tk.Label(left_frame, text="", wraplength=180)
         self.stockfish_path_text.pack(anchor=tk.NW)
 
+        # Create the select syzygy button
+        self.syzygy_path = ""
+        self.select_syzygy_button = tk.Button(
+            left_frame,
+            text="Select Syzygy Tablebases",
+            command=self.on_select_syzygy_button_listener,
+        )
+        self.select_syzygy_button.pack(anchor=tk.NW)
+
+        # Create the syzygy path text
+        self.syzygy_path_text = tk.Label(left_frame, text="", wraplength=180)
+        self.syzygy_path_text.pack(anchor=tk.NW)
+
         left_frame.grid(row=0, column=0, padx=5, sticky=tk.NW)
 
         # Right frame
@@ -285,7 +485,6 @@ class GUI:
             command=self.tree.yview
         )
         self.vsb.pack(fill=tk.Y, expand=True)
-        self.tree.configure(yscrollcommand=self.vsb.set)
 
         # Create the columns
         self.tree.column("# 1", anchor=tk.CENTER, width=35)
@@ -295,8 +494,26 @@ class GUI:
         self.tree.column("# 3", anchor=tk.CENTER, width=60)
         self.tree.heading("# 3", text="Black")
 
+        # Show the match moves in the Treeview
+        self.match_moves_view = MoveListView(self.tree, self.vsb, self.match_moves)
+
         treeview_frame.pack(anchor=tk.NW)
 
+        # Create the search statistics text (updated live while the engine thinks)
+        self.search_text = tk.Label(
+            right_frame, text="Eval: -, Depth: -", anchor=tk.NW, justify=tk.LEFT, height=4, wraplength=175
+        )
+        self.search_text.pack(anchor=tk.NW, fill=tk.X)
+
+        # Create the evaluation graph
+        eval_graph_canvas = tk.Canvas(right_frame, width=175, height=60, bg="white", highlightthickness=0)
+        eval_graph_canvas.pack(anchor=tk.NW, pady=(0, 5))
+        self.eval_graph = EvalGraph(eval_graph_canvas)
+
+        # Create the candidate moves text
+        self.lines_text = tk.Label(right_frame, text="", anchor=tk.W, justify=tk.LEFT)
+        self.lines_text.pack(anchor=tk.NW, fill=tk.X)
+
         # Create the export PGN button
         self.export_pgn_button = tk.Button(
             right_frame, text="Export PGN", command=self.on_export_pgn_button_listener
@@ -329,6 +546,9 @@ class GUI:
     def on_close_listener(self):
         # Set self.exit to True so that the threads will stop
         self.exit = True
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.stop_overlay()
         self.master.destroy()
 
     # Detects if the Stockfish Bot process is running
@@ -340,11 +560,6 @@ class GUI:
                 and not self.stockfish_bot_process.is_alive()
             ):
                 self.on_stop_button_listener()
-
-                # Restart the process if restart_after_stopping is True
-                if self.restart_after_stopping:
-                    self.restart_after_stopping = False
-                    self.on_start_button_listener()
             time.sleep(0.1)
 
     # Detects if Selenium Chromedriver is running
@@ -370,90 +585,156 @@ class GUI:
                 pass
             time.sleep(0.1)
 
-    # Responsible for communicating with the Stockfish Bot process
-    # The pipe can receive the following commands:
-    # - "START": Resets and starts the Stockfish Bot
-    # - "S_MOVE": Sends the Stockfish Bot a single move to make
-    #   Ex. "S_MOVEe4
-    # - "M_MOVE": Sends the Stockfish Bot multiple moves to make
-    #   Ex. "S_MOVEe4,c5,Nf3
-    # - "ERR_EXE": Notifies the GUI that the Stockfish Bot can't initialize Stockfish
-    # - "ERR_PERM": Notifies the GUI that the Stockfish Bot can't execute the Stockfish executable
-    # - "ERR_BOARD": Notifies the GUI that the Stockfish Bot can't find the board
-    # - "ERR_COLOR": Notifies the GUI that the Stockfish Bot can't find the player color
-    # - "ERR_MOVES": Notifies the GUI that the Stockfish Bot can't find the moves list
-    # - "ERR_GAMEOVER": Notifies the GUI that the current game is already over
+    # Responsible for communicating with the Stockfish Bot and the overlay processes
+    # The pipes receive frames of messages (see messages.py). The thread
+    # sleeps until a frame arrives and handles every pending frame at once
     def process_communicator_thread(self):
         while not self.exit:
+            pipes = {}
+            if self.stockfish_bot_pipe is not None:
+                pipes[self.stockfish_bot_pipe] = "bot"
+            if self.overlay_screen_pipe is not None:
+                pipes[self.overlay_screen_pipe] = "overlay"
+            if not pipes:
+                # Wait for the next start
+                self.stockfish_bot_pipe_ready.wait(0.5)
+                self.stockfish_bot_pipe_ready.clear()
+                continue
+
+            import multiprocess.connection
             try:
-                if (
-                    self.stockfish_bot_pipe is not None
-                    and self.stockfish_bot_pipe.poll()
-                ):
-                    data = self.stockfish_bot_pipe.recv()
-                    if data == "START":
-                        self.clear_tree()
-                        self.match_moves = []
-
-                        # Update the status text
-                        self.status_text["text"] = "Running"
-                        self.status_text["fg"] = "green"
-                        self.status_text.update()
-
-                        # Update the run button
-                        self.start_button["text"] = "Stop"
-                        self.start_button["state"] = "normal"
-                        self.start_button["command"] = self.on_stop_button_listener
-                        self.start_button.update()
-                    elif data[:7] == "RESTART":
-                        self.restart_after_stopping = True
-                        self.stockfish_bot_pipe.send("DELETE")
-                    elif data[:6] == "S_MOVE":
-                        move = data[6:]
-                        self.match_moves.append(move)
-                        self.insert_move(move)
-                        self.tree.yview_moveto(1)
-                    elif data[:6] == "M_MOVE":
-                        moves = data[6:].split(",")
-                        self.match_moves += moves
-                        self.set_moves(moves)
-                        self.tree.yview_moveto(1)
-                    elif data[:7] == "ERR_EXE":
-                        tk.messagebox.showerror(
-                            "Error",
-                            "Stockfish path provided is not valid!"
-                        )
-                    elif data[:8] == "ERR_PERM":
-                        tk.messagebox.showerror(
-                            "Error",
-                            "Stockfish path provided is not executable!"
-                        )
-                    elif data[:9] == "ERR_BOARD":
-                        tk.messagebox.showerror(
-                            "Error",
-                            "Cant find board!"
-                        )
-                    elif data[:9] == "ERR_COLOR":
-                        tk.messagebox.showerror(
-                            "Error",
-                            "Cant find player color!"
-                        )
-                    elif data[:9] == "ERR_MOVES":
-                        tk.messagebox.showerror(
-                            "Error",
-                            "Cant find moves list!"
-                        )
-                    elif data[:12] == "ERR_GAMEOVER":
-                        tk.messagebox.showerror(
-                            "Error",
-                            "Game has already finished!"
-                        )
-            except (BrokenPipeError, OSError):
-                self.stockfish_bot_pipe = None
+                ready = multiprocess.connection.wait(list(pipes), timeout=0.5)
+            except OSError:
+                # A pipe was closed by the stop button
+                continue
 
-            time.sleep(0.1)
+            for pipe in ready:
+                try:
+                    while pipe.poll():
+                        try:
+                            frame = messages.decode(pipe.recv_bytes())
+                        except ValueError as e:
+                            # The process speaks a different protocol version
+                            self.drop_pipe(pipe)
+                            pipe.close()
+                            self.status_text["text"] = "Error"
+                            self.status_text["fg"] = "red"
+                            self.status_text.update()
+                            tk.messagebox.showerror("Error", "Can't talk to the " + pipes[pipe] + " process: " + str(e))
+                            break
+
+                        for message_type, payload in frame:
+                            start = time.perf_counter()
+                            try:
+                                with tracing.span(message_type, "gui", process=pipes[pipe]):
+                                    self.handle_message(message_type, payload, pipes[pipe])
+                            except Exception:
+                                # A bad message shouldn't cut the GUI off from the process
+                                traceback.print_exc()
+                            self.metrics.observe("chessbot_gui_message_seconds", time.perf_counter() - start)
+                except (EOFError, BrokenPipeError, OSError):
+                    # The process stopped
+                    self.drop_pipe(pipe)
+
+    # Forgets the pipe of a process, so the communicator thread stops waiting on it
+    def drop_pipe(self, pipe):
+        if self.stockfish_bot_pipe is pipe:
+            self.stockfish_bot_pipe = None
+        if self.overlay_screen_pipe is pipe:
+            self.overlay_screen_pipe = None
+
+    # Messages shown for the errors of the Stockfish Bot
+    ERROR_MESSAGES = {
+        messages.ERR_EXE: "Stockfish path provided is not valid!",
+        messages.ERR_PERM: "Stockfish path provided is not executable!",
+        messages.ERR_BOARD: "Cant find board!",
+        messages.ERR_COLOR: "Cant find player color!",
+        messages.ERR_MOVES: "Cant find moves list!",
+        messages.ERR_GAMEOVER: "Game has already finished!",
+        messages.ERR_BOOK: "Opening book path provided is not a valid Polyglot book!",
+        messages.ERR_SYZYGY: "No Syzygy tablebases found in the directory provided!",
+        messages.ERR_INPUT: "The selected mouse input can't be used on this system!",
+    }
+
+    # Handles a single message from the Stockfish Bot process
+    # (or from the overlay process, which only sends metrics)
+    def handle_message(self, message_type, payload, process="bot"):
+        if message_type == messages.METRICS:
+            self.process_metrics[process] = payload
+        elif message_type == messages.TRACE:
+            self.trace_events.extend(payload)
+        elif message_type == messages.ARROWS:
+            self.send_overlay_command(messages.OVERLAY_ARROWS, payload)
+        elif message_type == messages.START:
+            self.match_moves.clear()
+            self.match_moves_view.scroll_to_end()
+            self.eval_graph.clear()
+
+            # Update the status text
+            self.status_text["text"] = "Running"
+            self.status_text["fg"] = "green"
+            self.status_text.update()
+
+            # Update the run button
+            self.start_button["text"] = "Stop"
+            self.start_button["state"] = "normal"
+            self.start_button["command"] = self.on_stop_button_listener
+            self.start_button.update()
+        elif message_type == messages.MOVES:
+            index, moves = payload
+            if index == len(self.match_moves) and len(moves) == 1:
+                # A single new move, so append it
+                self.match_moves.append(moves[0])
+            else:
+                # A takeback, a missed update or the first moves of the game
+                self.match_moves.replace(index, moves)
+                self.eval_graph.truncate(index + 1)
+            self.match_moves_view.scroll_to_end()
+        elif message_type == messages.INFO:
+            self.search_text["text"] = self.format_search_info(payload)
+        elif message_type == messages.SEARCH:
+            self.search_text["text"] = self.format_search_info(payload)
+            self.search_text.update()
+            self.eval_graph.add(payload["ply"], payload["score"])
+
+            # List the candidate moves when there is more than one
+            lines = payload["lines"] if len(payload["lines"]) > 1 else []
+            self.lines_text["text"] = "\n".join(
+                str(i + 1) + ". " + move + " (" + (score or "-") + ")" for i, (move, score, _) in enumerate(lines)
+            )
+            self.lines_text.update()
+        elif message_type == messages.CACHE:
+            hits, misses = payload
+            self.analysis_cache_text["text"] = f"Cache hits: {hits}, misses: {misses}"
+            self.analysis_cache_text.update()
+        elif message_type == messages.ERROR:
+            tk.messagebox.showerror(
+                "Error",
+                self.ERROR_MESSAGES.get(payload, "Unknown error: " + str(payload))
+            )
+
+    # Formats the progress or the result of a search (see messages.INFO and messages.SEARCH)
+    # Ex. "Eval: cp 34, Depth: 15/21\nTime: 0.52s, 1176 knps\nNodes: 612000, Hash: 1.4%\nPV: e2e4 e7e5 g1f3 b8c6"
+    @staticmethod
+    def format_search_info(info):
+        text = "Eval: " + (info["score"] or "-") + ", Depth: " + str(info["depth"] or "-")
+        if info.get("seldepth"):
+            text += "/" + str(info["seldepth"])
+        if info["nps"]:
+            text += "\nTime: " + f"{info['time']:.2f}s" + ", " + str(info["nps"] // 1000) + " knps"
+        if info.get("hashfull") is not None:
+            text += "\nNodes: " + str(info["nodes"]) + ", Hash: " + f"{info['hashfull'] / 10:.1f}%"
+        if info["pv"]:
+            text += "\nPV: " + " ".join(info["pv"][:4])
+        return text
 
     def keypress_listener_thread(self):
+        # keyboard looks for the input devices when it is imported,
+        # so wait until the shortcuts can be used
+        while not self.exit and not self.opened_browser:
+            time.sleep(0.1)
+        import keyboard
+
         while not self.exit:
             time.sleep(0.1)
             if not self.opened_browser:
@@ -471,16 +752,19 @@ class GUI:
         self.open_browser_button["state"] = "disabled"
         self.open_browser_button.update()
 
+        from selenium import webdriver
+        from selenium.common import WebDriverException
+        from selenium.webdriver.chrome.service import Service as ChromeService
+        from chromedriver import get_chromedriver_path
+
         # Open Webdriver
         options = webdriver.ChromeOptions()
         options.add_experimental_option("excludeSwitches", ["enable-logging", "enable-automation"])
         options.add_argument('--disable-blink-features=AutomationControlled')
         options.add_experimental_option('useAutomationExtension', False)
         try:
-            chrome_install = ChromeDriverManager().install()
-
-            folder = os.path.dirname(chrome_install)
-            chromedriver_path = os.path.join(folder, "chromedriver.exe")
+            # Only downloads the driver the first time a Chrome version is seen
+            chromedriver_path = get_chromedriver_path()
 
             service = ChromeService(chromedriver_path)
             self.chrome = webdriver.Chrome(
@@ -541,6 +825,23 @@ class GUI:
             )
             return
 
+        # Check if the clock safety margin value is valid
+        clock_margin = self.clock_margin.get()
+        if clock_margin < 0 or clock_margin > 5000:
+            tk.messagebox.showerror(
+                "Error",
+                "Safety Margin must be between 0 and 5000"
+            )
+            return
+
+        # Check if the book max ply value is valid
+        if self.book_max_ply.get() < 0:
+            tk.messagebox.showerror(
+                "Error",
+                "Max Ply must not be negative"
+            )
+            return
+
         # Check if stockfish path is not empty
         if self.stockfish_path == "":
             tk.messagebox.showerror(
@@ -556,14 +857,28 @@ class GUI:
             )
             return
 
+        # Check if non-stop matches are enabled when on chess.com
+        # (the bot can't start a new match there, so it would wait forever)
+        if self.enable_non_stop_matches.get() == 1 and self.website.get() == "chesscom":
+            tk.messagebox.showerror(
+                "Error", "Non-stop online matches are only supported on lichess.org"
+            )
+            return
+
+        import multiprocess
+        from stockfish_bot import StockfishBot
+
         # Create the pipes used for the communication
         # between the GUI and the Stockfish Bot process
         parent_conn, child_conn = multiprocess.Pipe()
         self.stockfish_bot_pipe = parent_conn
+        self.stockfish_bot_pipe_ready.set()
 
-        # Create the message queue that is used for the communication
-        # between the Stockfish and the Overlay processes
-        st_ov_queue = multiprocess.Queue()
+        # Show the overlay, without the arrows of the last run
+        self.start_overlay()
+        self.send_overlay_command(messages.OVERLAY_TRACING, self.enable_tracing.get() == 1)
+        self.send_overlay_command(messages.OVERLAY_CLEAR)
+        self.send_overlay_command(messages.OVERLAY_SHOW)
 
         # Create the Stockfish Bot process
         self.stockfish_bot_process = StockfishBot(
@@ -571,7 +886,6 @@ class GUI:
             self.chrome_session_id,
             self.website.get(),
             child_conn,
-            st_ov_queue,
             self.stockfish_path,
             self.enable_manual_mode.get() == 1,
             self.enable_mouseless_mode.get() == 1,
@@ -584,14 +898,19 @@ class GUI:
             self.stockfish_depth.get(),
             self.memory.get(),
             self.cpu_threads.get(),
+            self.book_path,
+            self.book_selection.get(),
+            self.book_max_ply.get(),
+            self.syzygy_path,
+            self.enable_analysis_cache.get() == 1,
+            self.enable_clock.get() == 1,
+            self.clock_margin.get(),
+            self.multipv.get(),
+            self.enable_tracing.get() == 1,
+            self.input_backend.get(),
         )
         self.stockfish_bot_process.start()
-
-        # Create the overlay
-        self.overlay_screen_process = multiprocess.Process(
-            target=run, args=(st_ov_queue,)
-        )
-        self.overlay_screen_process.start()
+        self.stockfish_bot_pipe_ready.set()
 
         # Update the run button
         self.running = True
@@ -610,15 +929,9 @@ class GUI:
             self.stockfish_bot_pipe.close()
             self.stockfish_bot_pipe = None
 
-        # Stop the overlay
-        if self.overlay_screen_process is not None:
-            self.overlay_screen_process.kill()
-            self.overlay_screen_process = None
-
-        # Close the overlay pipe
-        if self.overlay_screen_pipe is not None:
-            self.overlay_screen_pipe.close()
-            self.overlay_screen_pipe = None
+        # Hide the overlay until the next start
+        self.send_overlay_command(messages.OVERLAY_CLEAR)
+        self.send_overlay_command(messages.OVERLAY_HIDE)
 
         # Update the status text
         self.running = False
@@ -632,12 +945,120 @@ class GUI:
         self.start_button["command"] = self.on_start_button_listener
         self.start_button.update()
 
+    # Starts the overlay process, unless it is already running
+    # Its Qt application is created once, and reused by every start of the bot
+    def start_overlay(self):
+        if self.overlay_screen_process is not None and self.overlay_screen_process.is_alive():
+            return
+
+        import multiprocess
+
+        # Create the overlay, with a pipe for its metrics
+        self.overlay_queue = multiprocess.Queue()
+        overlay_conn, overlay_child_conn = multiprocess.Pipe(duplex=False)
+        self.overlay_screen_pipe = overlay_conn
+        self.overlay_screen_process = multiprocess.Process(
+            target=run_overlay, args=(self.overlay_queue, overlay_child_conn), daemon=True
+        )
+        self.overlay_screen_process.start()
+        self.stockfish_bot_pipe_ready.set()
+
+    # Sends a command to the overlay (see messages.OVERLAY_*), if it is running
+    def send_overlay_command(self, command, payload=None):
+        if self.overlay_queue is not None:
+            self.overlay_queue.put((command, payload))
+
+    # Asks the overlay to close, and stops it if it doesn't in time
+    def stop_overlay(self):
+        if self.overlay_screen_process is None:
+            return
+
+        self.send_overlay_command(messages.OVERLAY_SHUTDOWN)
+        self.overlay_screen_process.join(timeout=2)
+        if self.overlay_screen_process.is_alive():
+            self.overlay_screen_process.kill()
+        self.overlay_screen_process = None
+        self.overlay_queue = None
+
     def on_topmost_check_button_listener(self):
         if self.enable_topmost.get() == 1:
             self.master.attributes("-topmost", True)
         else:
             self.master.attributes("-topmost", False)
 
+    # Returns the metrics of every process (see metrics.py)
+    def get_process_metrics(self):
+        return dict(self.process_metrics, gui=self.metrics.to_dict())
+
+    def on_metrics_server_check_button_listener(self):
+        if self.enable_metrics_server.get() == 0:
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+                self.metrics_server = None
+            return
+
+        try:
+            port = self.metrics_server_port.get()
+            self.metrics_server = MetricsServer(port, self.get_process_metrics)
+        except (tk.TclError, OverflowError, OSError):
+            self.enable_metrics_server.set(0)
+            tk.messagebox.showerror("Error", "Can't serve the metrics on this port!")
+
+    # Tracing of the bot and the overlay starts with the next start
+    def on_tracing_check_button_listener(self):
+        if self.enable_tracing.get() == 1:
+            tracing.enable("GUI")
+        else:
+            tracing.disable()
+
+    def on_export_trace_button_listener(self):
+        # Create the file dialog
+        f = filedialog.asksaveasfile(
+            initialfile="trace.json",
+            defaultextension=".json",
+            filetypes=[("Chrome Trace Events", "*.json"), ("All Files", "*.*")],
+        )
+        if f is None:
+            return
+
+        # Write the spans of every process, which can be opened in Perfetto
+        self.trace_events.extend(tracing.drain())
+        json.dump({"traceEvents": list(self.trace_events), "displayTimeUnit": "ms"}, f)
+        f.close()
+
+    def on_show_stats_button_listener(self):
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+
+        self.stats_window = tk.Toplevel(self.master)
+        self.stats_window.title("Stats")
+        self.stats_window.attributes("-topmost", self.enable_topmost.get() == 1)
+        self.stats_text = tk.Label(self.stats_window, text="", font=("Courier", 9), justify=tk.LEFT, anchor=tk.NW)
+        self.stats_text.pack(anchor=tk.NW, padx=5, pady=5)
+        self.update_stats_window()
+
+    # Shows the percentiles of every metric, refreshed every second while the window is open
+    def update_stats_window(self):
+        if self.stats_window is None or not self.stats_window.winfo_exists():
+            return
+
+        lines = []
+        for process, data in summarize(self.get_process_metrics()).items():
+            lines.append(process)
+            for name, stats in data["histograms"].items():
+                # Show the times in milliseconds
+                scale, unit = (1000, "ms") if name.endswith("_seconds") else (1, "")
+                short_name = name.replace("chessbot_", "").replace("_seconds", "")
+                lines.append(
+                    f"  {short_name:<16} n={stats['count']:<6}"
+                    + "".join(f" {p}={stats[p] * scale:.1f}{unit}" for p in ["p50", "p95", "p99"])
+                )
+            for name, value in data["counters"].items():
+                lines.append(f"  {name.replace('chessbot_', ''):<16} {value}")
+        self.stats_text["text"] = "\n".join(lines) if lines else "No metrics yet"
+        self.stats_window.after(1000, self.update_stats_window)
+
     def on_export_pgn_button_listener(self):
         # Create the file dialog
         f = filedialog.asksaveasfile(
@@ -650,13 +1071,11 @@ class GUI:
 
         # Write the PGN to the file
         data = ""
-        for i in range(len(self.match_moves) // 2 + 1):
-            if len(self.match_moves) % 2 == 0 and i == len(self.match_moves) // 2:
-                continue
-            data += str(i + 1) + ". "
-            data += self.match_moves[i * 2] + " "
-            if (i * 2) + 1 < len(self.match_moves):
-                data += self.match_moves[i * 2 + 1] + " "
+        for i in range(self.match_moves.row_count):
+            number, white, black = self.match_moves.get_row(i)
+            data += str(number) + ". " + white + " "
+            if black != "":
+                data += black + " "
         f.write(data)
         f.close()
 
@@ -671,37 +1090,29 @@ class GUI:
         self.stockfish_path_text["text"] = self.stockfish_path
         self.stockfish_path_text.update()
 
-    # Clears the Treeview
-    def clear_tree(self):
-        self.tree.delete(*self.tree.get_children())
-        self.tree.update()
-
-    # Inserts a move into the Treeview
-    def insert_move(self, move):
-        cells_num = sum(
-            [len(self.tree.item(i)["values"]) - 1 for i in self.tree.get_children()]
+    def on_select_book_button_listener(self):
+        # Create the file dialog
+        f = filedialog.askopenfilename(
+            filetypes=[("Polyglot Opening Book", "*.bin"), ("All Files", "*.*")]
         )
-        if (cells_num % 2) == 0:
-            rows_num = len(self.tree.get_children())
-            self.tree.insert("", "end", text="1", values=(rows_num + 1, move))
-        else:
-            self.tree.set(self.tree.get_children()[-1], column=2, value=move)
-        self.tree.update()
-
-    # Overwrites the Treeview with the given list of moves
-    def set_moves(self, moves):
-        self.clear_tree()
+        if f is None:
+            return
 
-        # Insert in pairs
-        pairs = list(zip(*[iter(moves)] * 2))
-        for i, pair in enumerate(pairs):
-            self.tree.insert("", "end", text="1", values=(str(i + 1), pair[0], pair[1]))
+        # Set the book path
+        self.book_path = f
+        self.book_path_text["text"] = self.book_path
+        self.book_path_text.update()
 
-        # Insert the remaining one if it exists
-        if len(moves) % 2 == 1:
-            self.tree.insert("", "end", text="1", values=(len(pairs) + 1, moves[-1]))
+    def on_select_syzygy_button_listener(self):
+        # Create the directory dialog
+        f = filedialog.askdirectory()
+        if f is None:
+            return
 
-        self.tree.update()
+        # Set the Syzygy tablebases path
+        self.syzygy_path = f
+        self.syzygy_path_text["text"] = self.syzygy_path
+        self.syzygy_path_text.update()
 
     def on_manual_mode_checkbox_listener(self):
         if self.enable_manual_mode.get() == 1:
@@ -712,7 +1123,36 @@ class GUI:
             self.manual_mode_checkbox.update()
 
 
+# Prints how long every step of the startup took
+# steps is a list of (name, seconds)
+def print_startup_profile(steps):
+    for name, seconds in steps:
+        print(f"{name:<12}{seconds * 1000:8.1f} ms")
+    print(f"{'total':<12}{sum(seconds for _, seconds in steps) * 1000:8.1f} ms")
+
+    loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+    if loaded:
+        print("Imported before the window showed: " + ", ".join(loaded))
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chess bot GUI")
+    parser.add_argument("--profile-startup", action="store_true", help="print how long every startup step took")
+    args = parser.parse_args()
+
+    steps = [("imports", time.perf_counter() - IMPORTS_STARTED)]
+    start = time.perf_counter()
     window = tk.Tk()
+    steps.append(("tk", time.perf_counter() - start))
+
+    start = time.perf_counter()
     my_gui = GUI(window)
+    steps.append(("widgets", time.perf_counter() - start))
+
+    if args.profile_startup:
+        # Draw the window once, to include the time until it is on the screen
+        start = time.perf_counter()
+        window.update()
+        steps.append(("first frame", time.perf_counter() - start))
+        print_startup_profile(steps)
     window.mainloop()
@@ -0,0 +1,179 @@
+import argparse
+import json
+import sys
+import time
+from abc import ABC, abstractmethod
+
+from utilities import get_latency_stats
+
+# Input backends used to play moves with the mouse.
+# A backend drags a piece from one screen position to another and clicks
+# (for the promotion piece). It measures the time spent sending the input
+# events of every move, without the delays it was asked to wait for (the
+# mouse latency, the wait for the promotion dialog), and play() returns it.
+# - "pyautogui": Works on every platform, but every pyautogui call also
+#   sleeps for pyautogui.PAUSE and checks the failsafe corner
+# - "xtest": Posts the events straight to the X server with the XTest
+#   extension (Linux only, needs python-xlib), without any pause
+#
+# Benchmark: python src/input_backend.py --backend xtest --moves 20
+# (moves the real mouse between two points of the screen)
+
+BACKENDS = ["pyautogui", "xtest"]
+
+
+# Raised when a backend can't be used on this system
+class InputBackendError(Exception):
+    pass
+
+
+# Returns the input backend with the given name (one of BACKENDS)
+# Raises InputBackendError if the backend can't be used on this system
+def create_backend(name, mouse_latency=0.0):
+    if name == "xtest":
+        return XTestBackend(mouse_latency)
+    return PyAutoGuiBackend(mouse_latency)
+
+
+# Base abstract class for the input backends
+class InputBackend(ABC):
+    # Time to wait for the promotion dialog after dropping a pawn (in seconds)
+    PROMOTION_DELAY = 0.1
+
+    def __init__(self, mouse_latency=0.0):
+        self.mouse_latency = mouse_latency
+
+        # The dispatch time of the move being played (in seconds)
+        self.dispatch_time = 0.0
+
+    # Plays a move: drags the piece from start_pos to end_pos and then, for
+    # a promotion, clicks the promotion piece at promotion_pos (None if there isn't one)
+    # Returns the time spent sending the input events (in seconds)
+    def play(self, start_pos, end_pos, promotion_pos=None):
+        self.dispatch_time = 0.0
+        self.drag(start_pos, end_pos)
+        if promotion_pos is not None:
+            self.wait(self.PROMOTION_DELAY)
+            self.click(promotion_pos)
+        return self.dispatch_time
+
+    # Sleeps for the given time, without counting it as dispatch time
+    def wait(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # Drags the mouse from start_pos to end_pos with the left button down
+    @abstractmethod
+    def drag(self, start_pos, end_pos):
+        pass
+
+    # Clicks the left button at pos
+    @abstractmethod
+    def click(self, pos):
+        pass
+
+
+class PyAutoGuiBackend(InputBackend):
+    def __init__(self, mouse_latency=0.0):
+        super().__init__(mouse_latency)
+        try:
+            import pyautogui
+        except ImportError as e:
+            raise InputBackendError(str(e))
+        self.pyautogui = pyautogui
+
+    def drag(self, start_pos, end_pos):
+        start = time.perf_counter()
+        self.pyautogui.moveTo(start_pos[0], start_pos[1])
+        self.dispatch_time += time.perf_counter() - start
+
+        self.wait(self.mouse_latency)
+
+        start = time.perf_counter()
+        self.pyautogui.dragTo(end_pos[0], end_pos[1])
+        self.dispatch_time += time.perf_counter() - start
+
+    def click(self, pos):
+        start = time.perf_counter()
+        self.pyautogui.moveTo(x=pos[0], y=pos[1])
+        self.pyautogui.click(button='left')
+        self.dispatch_time += time.perf_counter() - start
+
+
+class XTestBackend(InputBackend):
+    def __init__(self, mouse_latency=0.0):
+        super().__init__(mouse_latency)
+        try:
+            from Xlib import X, display, error
+            from Xlib.ext import xtest
+        except ImportError:
+            raise InputBackendError("python-xlib is not installed")
+        self.X = X
+        self.xtest = xtest
+        try:
+            self.display = display.Display()
+        except error.DisplayError as e:
+            raise InputBackendError(str(e))
+        if not self.display.has_extension("XTEST"):
+            raise InputBackendError("The X server doesn't support the XTEST extension")
+
+    def send(self, event_type, pos=None):
+        if pos is None:
+            self.xtest.fake_input(self.display, event_type, 1)
+        else:
+            self.xtest.fake_input(self.display, event_type, x=int(pos[0]), y=int(pos[1]))
+
+    def drag(self, start_pos, end_pos):
+        start = time.perf_counter()
+        self.send(self.X.MotionNotify, start_pos)
+        self.display.sync()
+        self.dispatch_time += time.perf_counter() - start
+
+        self.wait(self.mouse_latency)
+
+        # The page only starts dragging once the pointer moves with the button down,
+        # so the piece is moved a pixel before it is moved to its square
+        start = time.perf_counter()
+        self.send(self.X.ButtonPress)
+        self.send(self.X.MotionNotify, (start_pos[0] + 1, start_pos[1] + 1))
+        self.send(self.X.MotionNotify, end_pos)
+        self.send(self.X.ButtonRelease)
+        self.display.sync()
+        self.dispatch_time += time.perf_counter() - start
+
+    def click(self, pos):
+        start = time.perf_counter()
+        self.send(self.X.MotionNotify, pos)
+        self.send(self.X.ButtonPress)
+        self.send(self.X.ButtonRelease)
+        self.display.sync()
+        self.dispatch_time += time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the dispatch time of an input backend")
+    parser.add_argument("--backend", choices=BACKENDS, default="pyautogui")
+    parser.add_argument("--moves", type=int, default=20, help="number of drags to make")
+    parser.add_argument("--start", type=int, nargs=2, default=[200, 200], metavar=("X", "Y"))
+    parser.add_argument("--end", type=int, nargs=2, default=[300, 300], metavar=("X", "Y"))
+    args = parser.parse_args()
+
+    try:
+        backend = create_backend(args.backend)
+    except InputBackendError as e:
+        print(f"Can't use the {args.backend} backend: {e}", file=sys.stderr)
+        return 1
+
+    dispatch_times = []
+    for i in range(args.moves):
+        if i % 2 == 0:
+            dispatch_times.append(backend.play(args.start, args.end))
+        else:
+            dispatch_times.append(backend.play(args.end, args.start))
+
+    print(json.dumps({"backend": args.backend, "moves": args.moves, "dispatch_time": get_latency_stats(dispatch_times)}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import json
+
+# Messages sent from the Stockfish Bot process (and the overlay) to the GUI.
+# Messages are collected and sent together in frames, where a frame
+# is [PROTOCOL_VERSION, [[type, payload], [type, payload], ...]]
+# encoded as compact JSON and sent as bytes over the pipe
+
+# Version of the frame format, bumped whenever a message changes
+PROTOCOL_VERSION = 7
+
+# The message types and their payloads:
+# - START: A game started, the bot is ready
+#   Payload: None
+START = "start"
+
+# - MOVES: Every move from index on is replaced by the given moves
+#   (index is the number of moves already shown for a new move)
+#   Payload: [index, moves], Ex. [4, ["Nf3", "Nc6"]]
+MOVES = "moves"
+
+# - INFO: The progress of the running engine search, sent a few times per second
+#   Payload: {"time", "depth", "seldepth", "score", "nodes", "nps", "hashfull", "pv"}
+#   Ex. {"time": 0.25, "depth": 12, "seldepth": 17, "score": "cp 30", "nodes": 301000,
+#        "nps": 1204000, "hashfull": 14, "pv": ["e2e4", "e7e5"]}
+INFO = "info"
+
+# - SEARCH: The result and the timing of the last engine search
+#   Payload: {"score", "pv", "time", "depth", "nodes", "nps", "lines", "ply"}, where
+#   "lines" holds [move, score, pv] for every MultiPV line, best first, and "ply"
+#   is the number of moves played before the searched position (the score is
+#   from the point of view of the side to move)
+#   Ex. {"score": "cp 34", "pv": ["e2e4", "e7e5"], "time": 0.52, "depth": 15, "nodes": 612000, "nps": 1176923,
+#        "lines": [["e4", "cp 34", ["e2e4", "e7e5"]], ["d4", "cp 30", ["d2d4", "d7d5"]]], "ply": 0}
+SEARCH = "search"
+
+# - CACHE: The analysis cache statistics
+#   Payload: [hits, misses], Ex. [12, 40]
+CACHE = "cache"
+
+# - METRICS: The latency histograms of the sending process (see metrics.py)
+#   Payload: Metrics.to_dict()
+METRICS = "metrics"
+
+# - TRACE: The spans recorded since the last TRACE message, when tracing is on (see tracing.py)
+#   Payload: a list of Chrome trace events
+TRACE = "trace"
+
+# - ARROWS: The arrows to draw on the board, forwarded by the GUI to the overlay
+#   Payload: [board_rect, arrows], where board_rect is the screen rectangle of the
+#   board [x, y, width, height] and arrows is a list of [start, end, rank]
+#   Ex. [[100, 200, 640, 640], [[[140, 780], [140, 700], 0]]]
+ARROWS = "arrows"
+
+# - ERROR: The bot stopped because of an error
+#   Payload: one of the ERR_* codes below
+ERROR = "error"
+
+# Error codes
+ERR_EXE = "exe"  # Can't initialize Stockfish
+ERR_PERM = "perm"  # Can't execute the Stockfish executable
+ERR_BOARD = "board"  # Can't find the board
+ERR_COLOR = "color"  # Can't find the player color
+ERR_MOVES = "moves"  # Can't find the moves list
+ERR_GAMEOVER = "gameover"  # The current game is already over
+ERR_BOOK = "book"  # Can't open the opening book
+ERR_SYZYGY = "syzygy"  # Can't find any Syzygy tablebases
+ERR_INPUT = "input"  # Can't use the selected input backend
+
+# Commands sent by the GUI to the overlay process over its queue, as (command, payload) tuples.
+# The overlay is started once and kept for every run of the bot
+OVERLAY_ARROWS = "arrows"  # Draw arrows, payload: the payload of an ARROWS message
+OVERLAY_SHOW = "show"  # Show the overlay over the board
+OVERLAY_HIDE = "hide"  # Hide the overlay
+OVERLAY_CLEAR = "clear"  # Remove the arrows
+OVERLAY_TRACING = "tracing"  # Turn tracing on or off, payload: True or False
+OVERLAY_SHUTDOWN = "shutdown"  # Close the overlay
+
+
+# Encodes a list of (type, payload) messages into a frame
+def encode(messages):
+    return json.dumps([PROTOCOL_VERSION, messages], separators=(",", ":")).encode("utf-8")
+
+
+# Decodes a frame into a list of (type, payload) messages
+# Raises ValueError if the frame is from a different protocol version
+def decode(frame):
+    version, messages = json.loads(frame.decode("utf-8"))
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version} (expected {PROTOCOL_VERSION})")
+    return [(message_type, payload) for message_type, payload in messages]
+
+
+# Collects messages and sends them over a pipe as a single frame
+class MessageSender:
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.pending = []
+
+    # Adds a message to the next frame
+    def add(self, message_type, payload=None):
+        self.pending.append([message_type, payload])
+
+    # Sends all the added messages in one frame
+    def flush(self):
+        if not self.pending:
+            return
+        self.pipe.send_bytes(encode(self.pending))
+        self.pending = []
+
+    # Sends a message right away (together with any added ones)
+    def send(self, message_type, payload=None):
+        self.add(message_type, payload)
+        self.flush()
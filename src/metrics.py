@@ -0,0 +1,187 @@
+import bisect
+import json
+import threading
+
+# Latency histograms of the bot, the GUI and the overlay.
+# Every process keeps its own Metrics and sends Metrics.to_dict() to
+# the GUI from time to time (see messages.METRICS). The GUI can serve
+# them all on localhost, as Prometheus text on /metrics and as JSON
+# (with percentiles) on /metrics.json, and shows them in its stats window
+
+# Bucket upper bounds
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+COUNT_BUCKETS = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+DISPATCH_BUCKETS = [0.0001, 0.00025, 0.0005] + LATENCY_BUCKETS
+NPS_BUCKETS = [10000, 30000, 100000, 300000, 1000000, 3000000, 10000000, 30000000, 100000000]
+
+# The histograms: name -> (description, buckets)
+HISTOGRAMS = {
+    "chessbot_scrape_seconds": ("Time to read the board state from the page", LATENCY_BUCKETS),
+    "chessbot_webdriver_calls": ("WebDriver commands per iteration of the wait for the opponent", COUNT_BUCKETS),
+    "chessbot_think_seconds": ("Engine search time per move", LATENCY_BUCKETS),
+    "chessbot_nps": ("Engine nodes per second per search", NPS_BUCKETS),
+    "chessbot_input_seconds": ("Time to play a move on the page (mouse or mouseless)", LATENCY_BUCKETS),
+    "chessbot_input_dispatch_seconds": ("Time the input backend spends sending the mouse events of a move", DISPATCH_BUCKETS),
+    "chessbot_move_latency_seconds": ("From noticing the opponent's move to playing ours", LATENCY_BUCKETS),
+    "chessbot_gui_message_seconds": ("Time the GUI takes to handle a message", LATENCY_BUCKETS),
+    "chessbot_overlay_paint_seconds": ("Time the overlay takes to paint the arrows", LATENCY_BUCKETS),
+}
+
+# The counters: name -> description
+COUNTERS = {
+    "chessbot_errors_total": "Errors that stopped the bot",
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+        # One count per bucket, the last one for the values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Estimates the q-th quantile (0-1) by interpolating inside
+    # its bucket, None if nothing has been observed
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count > 0 and seen + count >= rank:
+                if i == len(self.buckets):
+                    # Above the last bucket, so the best guess is its bound
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {"counts": list(self.counts), "count": self.count, "sum": self.sum}
+
+    @classmethod
+    def from_dict(cls, buckets, data):
+        histogram = cls(buckets)
+        histogram.counts = list(data["counts"])
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        return histogram
+
+
+# The histograms and counters of a process
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: Histogram(buckets) for name, (_, buckets) in HISTOGRAMS.items()}
+        self.counters = {name: 0 for name in COUNTERS}
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    # Returns the metrics as JSON serializable data
+    # (only the histograms that have values, to keep messages small)
+    def to_dict(self):
+        with self.lock:
+            return {
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items() if histogram.count > 0},
+                "counters": dict(self.counters),
+            }
+
+
+# Returns the metrics of every process (Ex. {"bot": Metrics.to_dict(), "gui": ...})
+# in the Prometheus text format, with the process as a label
+def to_prometheus(processes):
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        for process, data in processes.items():
+            if name not in data["histograms"]:
+                continue
+            histogram = data["histograms"][name]
+            cumulative = 0
+            for bound, count in zip(buckets + ["+Inf"], histogram["counts"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{process="{process}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{process="{process}"}} {histogram["sum"]}')
+            lines.append(f'{name}_count{{process="{process}"}} {histogram["count"]}')
+    for name, description in COUNTERS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for process, data in processes.items():
+            if name in data["counters"]:
+                lines.append(f'{name}{{process="{process}"}} {data["counters"][name]}')
+    return "\n".join(lines) + "\n"
+
+
+# Returns a summary of the metrics of every process:
+# {process: {"histograms": {name: {"count", "mean", "p50", "p95", "p99"}}, "counters": {name: value}}}
+def summarize(processes):
+    summary = {}
+    for process, data in processes.items():
+        histograms = {}
+        for name, histogram in data["histograms"].items():
+            if name not in HISTOGRAMS:
+                continue
+            histogram = Histogram.from_dict(HISTOGRAMS[name][1], histogram)
+            histograms[name] = {
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count if histogram.count else None,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+            }
+        summary[process] = {"histograms": histograms, "counters": dict(data["counters"])}
+    return summary
+
+
+# Serves the metrics on localhost in a background thread
+# get_processes is called for every request and returns the metrics of every process
+class MetricsServer:
+    def __init__(self, port, get_processes):
+        # http.server takes a while to import, and is only needed once the server is enabled
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        get = get_processes
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = to_prometheus(get()).encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(summarize(get())).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Don't print every request
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,134 @@
+# The moves of the current match, shown two per row (white, black)
+# Every operation only touches the moves that change, so appending
+# a move costs the same at move 10 and at move 500
+class MoveList:
+    def __init__(self):
+        self.moves = []
+
+    def __len__(self):
+        return len(self.moves)
+
+    # Number of rows needed to show the moves
+    @property
+    def row_count(self):
+        return (len(self.moves) + 1) // 2
+
+    # Returns the values of a row (Ex. (1, "e4", "c5"), (2, "Nf3", ""))
+    def get_row(self, row):
+        white = self.moves[row * 2]
+        black = self.moves[row * 2 + 1] if row * 2 + 1 < len(self.moves) else ""
+        return row + 1, white, black
+
+    def append(self, move):
+        self.moves.append(move)
+
+    # Replaces every move from index on with the given moves
+    def replace(self, index, moves):
+        del self.moves[index:]
+        self.moves.extend(moves)
+
+    def clear(self):
+        self.moves = []
+
+
+# Shows a MoveList in a Treeview, creating Tk items only for the rows
+# that fit in the Treeview. Scrolling changes which rows these items show,
+# and changes to the moves are drawn at most once per frame
+class MoveListView:
+    # Time between two redraws (in milliseconds)
+    FRAME_TIME = 16
+
+    def __init__(self, tree, scrollbar, move_list):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.move_list = move_list
+
+        # Number of rows that fit in the Treeview
+        self.visible_rows = int(tree["height"])
+
+        # The row shown at the top, and whether the view follows the last move
+        self.first_row = 0
+        self.follow = True
+
+        # The Treeview items and the values they show
+        self.items = []
+        self.shown = []
+
+        self.redraw_pending = False
+
+        # The scrollbar drives the view instead of the Treeview,
+        # which never holds more rows than it can show
+        self.scrollbar.configure(command=self.on_scroll)
+        self.tree.configure(yscrollcommand="")
+        self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.tree.bind("<Button-4>", self.on_mouse_wheel)
+        self.tree.bind("<Button-5>", self.on_mouse_wheel)
+
+    # Returns the largest possible first row
+    def get_last_first_row(self):
+        return max(0, self.move_list.row_count - self.visible_rows)
+
+    # Shows the last moves (Ex. after a new move)
+    def scroll_to_end(self):
+        self.follow = True
+        self.schedule_redraw()
+
+    # Scrolls the view so that it starts from the given row
+    def scroll_to(self, row):
+        last_first_row = self.get_last_first_row()
+        self.first_row = max(0, min(row, last_first_row))
+        self.follow = self.first_row == last_first_row
+        self.schedule_redraw()
+
+    # Called by the scrollbar
+    # Ex. ("moveto", "0.5"), ("scroll", "1", "units"), ("scroll", "-1", "pages")
+    def on_scroll(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * self.move_list.row_count))
+        elif args[0] == "scroll":
+            step = self.visible_rows if args[2] == "pages" else 1
+            self.scroll_to(self.first_row + int(args[1]) * step)
+
+    def on_mouse_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.first_row - 3)
+        else:
+            self.scroll_to(self.first_row + 3)
+        return "break"
+
+    # Redraws the view on the next frame (once, no matter how many times it is called)
+    def schedule_redraw(self):
+        if self.redraw_pending:
+            return
+        self.redraw_pending = True
+        self.tree.after(self.FRAME_TIME, self.redraw)
+
+    def redraw(self):
+        self.redraw_pending = False
+
+        row_count = self.move_list.row_count
+        if self.follow:
+            self.first_row = self.get_last_first_row()
+        else:
+            self.first_row = min(self.first_row, self.get_last_first_row())
+        rows = min(self.visible_rows, row_count - self.first_row)
+
+        # Create or remove items so that there is one per visible row
+        while len(self.items) < rows:
+            self.items.append(self.tree.insert("", "end", values=()))
+            self.shown.append(None)
+        while len(self.items) > rows:
+            self.tree.delete(self.items.pop())
+            self.shown.pop()
+
+        # Only update the rows that show something different
+        for i, item in enumerate(self.items):
+            values = self.move_list.get_row(self.first_row + i)
+            if self.shown[i] != values:
+                self.tree.item(item, values=values)
+                self.shown[i] = values
+
+        if row_count == 0:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.first_row / row_count, (self.first_row + rows) / row_count)
@@ -1,37 +1,75 @@
 import math
+import queue
 import sys
 import threading
-from PyQt6.QtCore import Qt, QPoint
-from PyQt6.QtGui import QBrush, QColor, QPainter, QPen, QGuiApplication, QPolygon
+import time
+from PyQt6.QtCore import Qt, QPoint, QTimer, pyqtSignal
+from PyQt6.QtGui import QBrush, QColor, QPainter, QPen, QPolygon, QRegion
 from PyQt6.QtWidgets import QApplication, QWidget
 
+import messages
+from messages import MessageSender
+from metrics import Metrics
+import tracing
+
 
 class OverlayScreen(QWidget):
-    def __init__(self, stockfish_queue):
+    # Emitted by the message queue thread with every command,
+    # so that the window is only changed by the Qt GUI thread
+    message_received = pyqtSignal(object)
+
+    # Extra space around the board, for the arrow heads that stick out of it
+    MARGIN = 30
+
+    # The opacity and the size of the arrows, from the best move to the worst
+    ARROW_ALPHAS = [122, 90, 70, 55, 45]
+    ARROW_HEIGHTS = [25, 21, 18, 16, 14]
+
+    # Time between two metrics updates sent to the GUI (in milliseconds)
+    METRICS_INTERVAL = 1000
+
+    def __init__(self, command_queue, pipe=None):
         super().__init__()
-        self.stockfish_queue = stockfish_queue
+        self.command_queue = command_queue
 
-        # Set the window to be the size of the screen
-        self.screen = QGuiApplication.screens()[0]
-        self.setFixedWidth(self.screen.size().width())
-        self.setFixedHeight(self.screen.size().height())
+        # Send the paint times to the GUI (if there is a pipe to it)
+        self.metrics = Metrics()
+        self.sender = None
+        if pipe is not None:
+            self.sender = MessageSender(pipe)
+            self.metrics_timer = QTimer(self)
+            self.metrics_timer.timeout.connect(self.send_metrics)
+            self.metrics_timer.start(self.METRICS_INTERVAL)
 
         # Set the window to be transparent
         self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.WindowStaysOnTopHint)
 
-        # A list of QPolygon objects containing the points of the arrows
+        # The screen rectangle of the board the window covers (x, y, width, height)
+        self.board_rect = None
+
+        # False while the overlay is hidden (between two runs of the bot)
+        self.shown = False
+
+        # A list of (QPolygon, rank) tuples containing the points of the arrows
+        # and their rank (0 for the best move)
         self.arrows = []
 
+        # The arrow polygons for the current board rectangle
+        # Ex. self.arrow_polygons[((x1, y1), (x2, y2), rank)] -> QPolygon
+        self.arrow_polygons = {}
+
         # Start the message queue thread
-        self.message_queue_thread = threading.Thread(target=self.message_queue_thread)
+        self.message_received.connect(self.on_message_received)
+        self.message_queue_thread = threading.Thread(target=self.message_queue_thread, daemon=True)
         self.message_queue_thread.start()
 
     def message_queue_thread(self):
         """
-        This thread is used to receive messages from the stockfish message queue
-        and update the arrows
+        This thread is used to receive the commands from the GUI (see messages.OVERLAY_*)
+        and pass them to the GUI thread. Arrows that are already followed by
+        newer arrows are skipped, as only the latest arrows are shown
         Args:
             None
         Returns:
@@ -39,43 +77,166 @@ class OverlayScreen(QWidget):
         """
 
         while True:
-            message = self.stockfish_queue.get()
-            self.set_arrows(message)
+            commands = [self.command_queue.get()]
+            while True:
+                try:
+                    commands.append(self.command_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            pending = []
+            for command in commands:
+                if command[0] == messages.OVERLAY_ARROWS and pending and pending[-1][0] == messages.OVERLAY_ARROWS:
+                    pending[-1] = command
+                else:
+                    pending.append(command)
+            for command in pending:
+                self.message_received.emit(command)
+                if command[0] == messages.OVERLAY_SHUTDOWN:
+                    return
+
+    def on_message_received(self, message):
+        """
+        This function is called in the GUI thread with a command from the GUI process
+        Args:
+            message: A tuple (command, payload), where command is one of messages.OVERLAY_*.
+            The payload of the arrows is [board_rect, arrows], where board_rect is the screen
+            rectangle of the board as [x, y, width, height] and arrows is a list of arrows
+            as accepted by set_arrows
+        Returns:
+            None
+        """
+
+        command, payload = message
+        if command == messages.OVERLAY_ARROWS:
+            board_rect, arrows = payload
+            with tracing.span("set_arrows", "overlay", arrows=len(arrows)):
+                if board_rect is not None:
+                    self.set_board_rect(tuple(board_rect))
+                self.set_arrows(arrows)
+        elif command == messages.OVERLAY_SHOW:
+            self.shown = True
+            if self.board_rect is not None:
+                self.show()
+        elif command == messages.OVERLAY_HIDE:
+            self.shown = False
+            self.hide()
+        elif command == messages.OVERLAY_CLEAR:
+            self.set_arrows([])
+        elif command == messages.OVERLAY_TRACING:
+            if payload:
+                tracing.enable("Overlay")
+            else:
+                tracing.disable()
+        elif command == messages.OVERLAY_SHUTDOWN:
+            # Send the last metrics before closing
+            if self.sender is not None:
+                self.metrics_timer.stop()
+                self.send_metrics()
+            QApplication.instance().quit()
+
+    def set_board_rect(self, board_rect):
+        """
+        This function is used to move the window over the board
+        Args:
+            board_rect: The screen rectangle of the board as (x, y, width, height)
+        Returns:
+            None
+        """
+
+        if board_rect == self.board_rect:
+            return
+
+        self.board_rect = board_rect
+        self.arrow_polygons = {}
+        self.arrows = []
+
+        x, y, width, height = board_rect
+        self.setGeometry(x - self.MARGIN, y - self.MARGIN, width + 2 * self.MARGIN, height + 2 * self.MARGIN)
+        if self.shown and not self.isVisible():
+            self.show()
+        self.update()
 
     def set_arrows(self, arrows):
         """
         This function is used to set the arrows to be drawn on the screen
         Args:
             arrows: A list of tuples containing the start and end position of the arrows
-            in the form of ((start_point, end_point), (start_point, end_point))
+            in the form of ((start_point, end_point), (start_point, end_point)),
+            in screen coordinates. An arrow can also have a third item, its rank
+            (0 for the best move), and lower ranked arrows are drawn fainter and thinner
         Returns:
             None
         """
 
+        if self.board_rect is None:
+            return
+
+        old_arrows = self.arrows
         self.arrows = []
         for arrow in arrows:
-            poly = self.get_arrow_polygon(
-                QPoint(arrow[0][0], arrow[0][1]),
-                QPoint(arrow[1][0], arrow[1][1])
-            )
-            self.arrows.append(poly)
-        self.update()
+            rank = min(arrow[2] if len(arrow) > 2 else 0, len(self.ARROW_HEIGHTS) - 1)
+            key = (tuple(arrow[0]), tuple(arrow[1]), rank)
+            poly = self.arrow_polygons.get(key)
+            if poly is None:
+                # Convert the points to window coordinates
+                origin_x, origin_y = self.board_rect[0] - self.MARGIN, self.board_rect[1] - self.MARGIN
+                poly = self.get_arrow_polygon(
+                    QPoint(arrow[0][0] - origin_x, arrow[0][1] - origin_y),
+                    QPoint(arrow[1][0] - origin_x, arrow[1][1] - origin_y),
+                    self.ARROW_HEIGHTS[rank]
+                )
+                if poly is None:
+                    continue
+                self.arrow_polygons[key] = poly
+            self.arrows.append((poly, rank))
+
+        # Only repaint where the arrows were and where they are now
+        dirty = QRegion()
+        for poly, _ in old_arrows + self.arrows:
+            dirty = dirty.united(QRegion(poly.boundingRect().adjusted(-1, -1, 1, 1)))
+        if not dirty.isEmpty():
+            self.update(dirty)
+
+    def send_metrics(self):
+        """
+        This function is used to send the metrics of the overlay to the GUI
+        Args:
+            None
+        Returns:
+            None
+        """
+
+        try:
+            # The spans are sent along with the metrics
+            if tracing.is_enabled():
+                self.sender.add(messages.TRACE, tracing.drain())
+            self.sender.send(messages.METRICS, self.metrics.to_dict())
+        except (BrokenPipeError, OSError):
+            self.metrics_timer.stop()
 
     def paintEvent(self, event):
-        super().paintEvent(event)
-        painter = QPainter(self)
-        painter.setPen(QPen(Qt.GlobalColor.red, 1, Qt.PenStyle.NoPen))
-        painter.setBrush(QBrush(QColor(255, 0, 0, 122), Qt.BrushStyle.SolidPattern))
-        for arrow in self.arrows:
-            painter.drawPolygon(arrow)
-        painter.end()
-
-    def get_arrow_polygon(self, start_point, end_point):
+        start = time.perf_counter()
+        with tracing.span("paint", "overlay"):
+            super().paintEvent(event)
+            painter = QPainter(self)
+            painter.setClipRegion(event.region())
+            painter.setPen(QPen(Qt.GlobalColor.red, 1, Qt.PenStyle.NoPen))
+
+            # Draw the best move last, so that it is on top
+            for arrow, rank in reversed(self.arrows):
+                painter.setBrush(QBrush(QColor(255, 0, 0, self.ARROW_ALPHAS[rank]), Qt.BrushStyle.SolidPattern))
+                painter.drawPolygon(arrow)
+            painter.end()
+        self.metrics.observe("chessbot_overlay_paint_seconds", time.perf_counter() - start)
+
+    def get_arrow_polygon(self, start_point, end_point, arrow_height=25):
         """
         This function is used to get the polygon for the arrow
         Args:
             start_point: The start point of the arrow
             end_point: The end point of the arrow
+            arrow_height: The size of the arrow head
         Returns:
             A QPolygon object containing the points of the arrow
         """
@@ -91,7 +252,6 @@ class OverlayScreen(QWidget):
             perp_x = -norm_y
             perp_y = norm_x
 
-            arrow_height = 25
             left_x = end_point.x() + arrow_height * norm_x * 1.5 + arrow_height * perp_x
             left_y = end_point.y() + arrow_height * norm_y * 1.5 + arrow_height * perp_y
 
@@ -112,16 +272,19 @@ class OverlayScreen(QWidget):
             print(e)
 
 
-def run(stockfish_queue):
+def run(command_queue, pipe=None):
     """
-    This function is used to run the overlay
+    This function is used to run the overlay, until it gets the shutdown command
     Args:
-        stockfish_queue: The message queue used to communicate with the stockfish thread
+        command_queue: The queue the GUI sends its commands to (see messages.OVERLAY_*)
+        pipe: The pipe used to send the metrics (and the spans) to the GUI (optional)
     Returns:
         None
     """
 
     app = QApplication(sys.argv)
-    overlay = OverlayScreen(stockfish_queue)
-    overlay.show()
+
+    # Closing the last window must not quit, as the overlay is only hidden between runs
+    app.setQuitOnLastWindowClosed(False)
+    overlay = OverlayScreen(command_queue, pipe)
     app.exec()
@@ -1,26 +1,39 @@
 import multiprocess
-from stockfish import Stockfish
-import pyautogui
 import time
 import sys
 import os
 import chess
+import chess.polyglot
+import chess.syzygy
 import re
 from grabbers.chesscom_grabber import ChesscomGrabber
 from grabbers.lichess_grabber import LichessGrabber
-from utilities import char_to_num
-import keyboard
+import chess.engine
+from engine import Engine
+from analysis_cache import AnalysisCache
+from board_sync import BoardSync
+from input_backend import create_backend, InputBackendError
+import messages
+from messages import MessageSender
+from metrics import Metrics
+import tracing
 
 
 class StockfishBot(multiprocess.Process):
-    def __init__(self, chrome_url, chrome_session_id, website, pipe, overlay_queue, stockfish_path, enable_manual_mode, enable_mouseless_mode, enable_non_stop_puzzles, enable_non_stop_matches, mouse_latency, bongcloud, slow_mover, skill_level, stockfish_depth, memory, cpu_threads):
+    # Time between two search progress updates sent to the GUI (in seconds)
+    INFO_INTERVAL = 0.25
+
+    # Time between two metrics updates sent to the GUI (in seconds)
+    METRICS_INTERVAL = 1.0
+
+    def __init__(self, chrome_url, chrome_session_id, website, pipe, stockfish_path, enable_manual_mode, enable_mouseless_mode, enable_non_stop_puzzles, enable_non_stop_matches, mouse_latency, bongcloud, slow_mover, skill_level, stockfish_depth, memory, cpu_threads, book_path, book_selection, book_max_ply, syzygy_path, enable_analysis_cache, enable_clock, clock_margin, multipv, enable_tracing, input_backend="pyautogui"):
         multiprocess.Process.__init__(self)
 
         self.chrome_url = chrome_url
         self.chrome_session_id = chrome_session_id
         self.website = website
         self.pipe = pipe
-        self.overlay_queue = overlay_queue
+        self.sender = None
         self.stockfish_path = stockfish_path
         self.enable_manual_mode = enable_manual_mode
         self.enable_mouseless_mode = enable_mouseless_mode
@@ -34,30 +47,37 @@ class StockfishBot(multiprocess.Process):
         self.grabber = None
         self.memory = memory
         self.cpu_threads = cpu_threads
+        self.book_path = book_path
+        self.book_selection = book_selection
+        self.book_max_ply = book_max_ply
+        self.syzygy_path = syzygy_path
+        self.enable_analysis_cache = enable_analysis_cache
+        self.enable_clock = enable_clock
+        self.clock_margin = clock_margin
+        self.multipv = multipv
+        self.enable_tracing = enable_tracing
+
+        # The name of the input backend, it is created in the bot process (see input_backend.py)
+        self.input_backend_name = input_backend
+        self.input_backend = None
+        self.book = None
+        self.tablebase = None
+        self.tablebase_max_pieces = 0
+        self.analysis_cache = None
         self.is_white = None
+        self.board_state = None
+
+        # The lines (score, PV) of the last engine search, best first
+        self.candidates = []
+
+        # The latency histograms of the bot (see metrics.py)
+        self.metrics = Metrics()
+        self.metrics_sent_at = 0
 
     # Converts a move to screen coordinates
     # Example: "a1" -> (x, y)
     def move_to_screen_pos(self, move):
-        # Get the absolute top left corner of the website
-        canvas_x_offset, canvas_y_offset = self.grabber.get_top_left_corner()
-
-        # Get the absolute board position
-        board_x = canvas_x_offset + self.grabber.get_board().location["x"]
-        board_y = canvas_y_offset + self.grabber.get_board().location["y"]
-
-        # Get the square size
-        square_size = self.grabber.get_board().size['width'] / 8
-
-        # Depending on the player color, the board is flipped, so the coordinates need to be adjusted
-        if self.is_white:
-            x = board_x + square_size * (char_to_num(move[0]) - 1) + square_size / 2
-            y = board_y + square_size * (8 - int(move[1])) + square_size / 2
-        else:
-            x = board_x + square_size * (8 - char_to_num(move[0])) + square_size / 2
-            y = board_y + square_size * (int(move[1]) - 1) + square_size / 2
-
-        return x, y
+        return self.grabber.square_to_screen_pos(move, self.is_white)
 
     def get_move_pos(self, move):  # sourcery skip: remove-redundant-slice-index
         # Get the start and end position screen coordinates
@@ -71,210 +91,536 @@ class StockfishBot(multiprocess.Process):
         # Get the start and end position screen coordinates
         start_pos, end_pos = self.get_move_pos(move)
 
-        # Drag the piece from the start to the end position
-        pyautogui.moveTo(start_pos[0], start_pos[1])
-        time.sleep(self.mouse_latency)
-        pyautogui.dragTo(end_pos[0], end_pos[1])
-
         # Check for promotion. If there is a promotion,
         # promote to the corresponding piece type
+        promotion_pos = None
         if len(move) == 5:
-            time.sleep(0.1)
-            end_pos_x = None
-            end_pos_y = None
+            # The promotion pieces are listed below the promotion square on the
+            # screen (queen, knight, rook, bishop), which is towards rank 1
+            # for white and towards rank 8 for black
+            rank_step = -1 if self.is_white else 1
+            end_pos_x, end_pos_y = end_pos
             if move[4] == "n":
-                end_pos_x, end_pos_y = self.move_to_screen_pos(move[2] + str(int(move[3]) - 1))
+                end_pos_x, end_pos_y = self.move_to_screen_pos(move[2] + str(int(move[3]) + rank_step))
             elif move[4] == "r":
-                end_pos_x, end_pos_y = self.move_to_screen_pos(move[2] + str(int(move[3]) - 2))
+                end_pos_x, end_pos_y = self.move_to_screen_pos(move[2] + str(int(move[3]) + rank_step * 2))
             elif move[4] == "b":
-                end_pos_x, end_pos_y = self.move_to_screen_pos(move[2] + str(int(move[3]) - 3))
+                end_pos_x, end_pos_y = self.move_to_screen_pos(move[2] + str(int(move[3]) + rank_step * 3))
+            promotion_pos = (end_pos_x, end_pos_y)
+
+        # Drag the piece from the start to the end position (and pick the promotion piece)
+        dispatch_time = self.input_backend.play(start_pos, end_pos, promotion_pos)
+        self.metrics.observe("chessbot_input_dispatch_seconds", dispatch_time)
 
-            pyautogui.moveTo(x=end_pos_x, y=end_pos_y)
-            pyautogui.click(button='left')
+    # Looks the position up in the opening book
+    # Returns the book move (Ex. "e2e4"), None if there isn't one
+    def get_book_move(self, board):
+        if self.book is None or len(board.move_stack) >= self.book_max_ply:
+            return None
 
-    def wait_for_gui_to_delete(self):
-        while self.pipe.recv() != "DELETE":
-            pass
+        try:
+            if self.book_selection == "random":
+                entry = self.book.weighted_choice(board)
+            else:
+                entry = self.book.find(board)
+        except IndexError:
+            return None
+
+        return entry.move.uci()
+
+    # Probes the Syzygy tablebases for the position
+    # Returns the move that keeps the best result with the best distance
+    # to zeroing (DTZ) (Ex. "e2e4"), None if the position is not in the tablebases
+    def get_tablebase_move(self, board):
+        if self.tablebase is None or chess.popcount(board.occupied) > self.tablebase_max_pieces:
+            return None
+
+        best_move = None
+        best_key = None
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    return move.uci()
+
+                # The probes are from the opponent's point of view
+                wdl = -self.tablebase.probe_wdl(board)
+                dtz = -self.tablebase.probe_dtz(board)
+            except KeyError:
+                # Missing table or castling rights
+                return None
+            finally:
+                board.pop()
+
+            # When winning, prefer zeroing moves and then the fastest win,
+            # when losing, avoid zeroing moves and prefer the slowest loss
+            if wdl > 0:
+                key = (wdl, zeroing, -dtz)
+            elif wdl < 0:
+                key = (wdl, not zeroing, -dtz)
+            else:
+                key = (wdl, False, 0)
+
+            if best_key is None or key > best_key:
+                best_key = key
+                best_move = move
+
+        return best_move.uci() if best_move is not None else None
+
+    # Returns the clocks from the last snapshot if time management is enabled, None otherwise
+    def get_clock(self):
+        if not self.enable_clock:
+            return None
+        return self.board_state["clock"]
+
+    # Gets the best move from the analysis cache or, if it is not there, from
+    # the engine (using the ponder search on a ponder hit)
+    # Returns the best move (Ex. "e2e4"), None if the game ended while thinking
+    def get_engine_move(self, engine, board, ponder_hit):
+        self.candidates = []
+
+        # The cache only keeps the best line, so it is not used
+        # when the next best moves are shown as well
+        if self.analysis_cache is not None and self.multipv == 1:
+            cached = self.analysis_cache.get(board, self.stockfish_depth, self.skill_level, 1)
+            self.sender.add(messages.CACHE, [self.analysis_cache.hits, self.analysis_cache.misses])
+            if cached is not None:
+                best_move, score, pv, depth = cached
+                engine.stop_ponder()
+                self.candidates = [(score, pv)]
+                self.sender.add(messages.SEARCH, {"score": score, "pv": pv, "time": 0, "depth": depth, "nodes": None, "nps": None, "lines": self.get_lines_payload(board), "ply": len(board.move_stack)})
+
+                # The expected reply of the opponent is the second move of the PV
+                engine.ponder_move = pv[1] if len(pv) > 1 else None
+                return best_move
+
+        if ponder_hit:
+            # The engine has been searching this position on the opponent's time
+            search = engine.ponder_hit(self.get_clock())
+        else:
+            search = engine.start_search(board, self.get_clock())
+
+        # While the engine thinks, keep an eye on the page, so that a game
+        # that ends during the search (resignation, timeout) is noticed right away,
+        # and show the progress of the search in the GUI
+        last_info = time.time()
+        while not search.wait(timeout=0.1):
+            if self.update_board_state()["is_game_over"]:
+                search.stop()
+                return None
+
+            if time.time() - last_info >= self.INFO_INTERVAL:
+                self.sender.send(messages.INFO, search.get_info())
+                last_info = time.time()
+
+        best_move = engine.finish_search(search)
+
+        stats = search.get_stats()
+        self.metrics.observe("chessbot_think_seconds", stats["time"])
+        if stats["nps"]:
+            self.metrics.observe("chessbot_nps", stats["nps"])
+
+        # Let the GUI know how the search went
+        score, pv = search.get_score_and_pv()
+        self.candidates = search.get_lines()
+        self.sender.add(messages.SEARCH, dict(search.get_stats(), score=score, pv=pv, lines=self.get_lines_payload(board), ply=len(board.move_stack)))
+
+        # Store the result for the next time this position comes up
+        # (under the depth that was reached, as the clock may stop the search earlier,
+        # so a shallower result is only used if the bot is set to a lower depth)
+        if self.analysis_cache is not None and self.multipv == 1 and best_move is not None:
+            depth = search.get_stats()["depth"] or self.stockfish_depth
+            self.analysis_cache.put(board, depth, self.skill_level, 1, best_move, score, pv)
+
+        return best_move
+
+    # Returns the candidate moves of the last search for the GUI
+    # Ex. [["Nf3", "cp 34", ["g1f3", "d7d5"]], ["e4", "cp 30", ["e2e4", "e7e5"]]]
+    def get_lines_payload(self, board):
+        return [[board.san(chess.Move.from_uci(pv[0])), score, pv] for score, pv in self.candidates if len(pv) > 0]
+
+    # Returns the overlay arrows for the candidate moves of the last
+    # search, ranked from the best one, or a single arrow for the given
+    # move if it didn't come from the engine
+    def get_arrows(self, move):
+        moves = [pv[0] for _, pv in self.candidates if len(pv) > 0]
+        if len(moves) == 0 or moves[0] != move:
+            moves = [move]
+
+        arrows = []
+        for rank, candidate in enumerate(moves):
+            start_pos, end_pos = self.get_move_pos(candidate)
+            arrows.append(((int(start_pos[0]), int(start_pos[1])), (int(end_pos[0]), int(end_pos[1])), rank))
+        return arrows
+
+    # Picks the move for the player to play: the bongcloud, the opening
+    # book, the tablebases and then the engine are tried in that order
+    # Returns (move, suggested_move), where suggested_move is the move
+    # only if it came from the engine, (None, None) if the game is over
+    def get_move(self, engine, board, ponder_hit):
+        move = None
+        suggested_move = None
+        self.candidates = []
+        move_count = len(board.move_stack)
+        if self.bongcloud and move_count <= 3:
+            if move_count == 0:
+                move = "e2e3"
+            elif move_count == 1:
+                move = "e7e6"
+            elif move_count == 2:
+                move = "e1e2"
+            elif move_count == 3:
+                move = "e8e7"
+
+            # Hardcoded bongcloud move is not legal,
+            # so find a legal move
+            if not board.is_legal(chess.Move.from_uci(move)):
+                move = None
+
+        # Play from the opening book while the game is still in it
+        if move is None:
+            move = self.get_book_move(board)
+
+        # Play the tablebase move once there are few enough pieces left
+        if move is None:
+            move = self.get_tablebase_move(board)
+
+        if move is None:
+            suggested_move = self.get_engine_move(engine, board, ponder_hit)
+            move = suggested_move
+        elif ponder_hit:
+            engine.stop_ponder()
+
+        return move, suggested_move
+
+    # Sends the moves that changed to the GUI (together with any pending messages)
+    # Ex. (4, ["Nf3", "Nc6"]) replaces every move from the fifth one on with "Nf3", "Nc6"
+    def send_moves_change(self, change):
+        index, moves = change
+        self.sender.send(messages.MOVES, [index, moves])
+
+    # Grabs the whole board state from the page in a single round trip
+    def update_board_state(self):
+        start = time.perf_counter()
+        with tracing.span("snapshot", "bot"):
+            self.board_state = self.grabber.snapshot()
+        self.metrics.observe("chessbot_scrape_seconds", time.perf_counter() - start)
+        self.grabber.update_geometry(self.board_state)
+
+        # The board state is read all the time, even while the
+        # engine thinks, so this is where the metrics are sent from
+        if time.time() - self.metrics_sent_at >= self.METRICS_INTERVAL:
+            self.send_metrics()
+
+        return self.board_state
+
+    def send_metrics(self):
+        # The spans are sent along with the metrics
+        if tracing.is_enabled():
+            self.sender.add(messages.TRACE, tracing.drain())
+        self.sender.send(messages.METRICS, self.metrics.to_dict())
+        self.metrics_sent_at = time.time()
+
+    # Waits until a new game has been loaded on the page
+    # after navigating away from a finished one
+    def wait_for_new_game(self):
+        while True:
+            state = self.update_board_state()
+            if state["board"] is not None and not state["is_game_over"]:
+                return
+            time.sleep(0.1)
 
     def go_to_next_puzzle(self):
         self.grabber.click_puzzle_next()
-        self.pipe.send("RESTART")
-        self.wait_for_gui_to_delete()
+        self.grabber.reset_game_state()
+        self.wait_for_new_game()
 
     def find_new_online_match(self):
         time.sleep(2)
         self.grabber.click_game_next()
-        self.pipe.send("RESTART")
-        self.wait_for_gui_to_delete()
-
-    def run(self):
-        # sourcery skip: extract-duplicate-method, switch, use-fstring-for-concatenation
-        if self.website == "chesscom":
-            self.grabber = ChesscomGrabber(self.chrome_url, self.chrome_session_id)
-        else:
-            self.grabber = LichessGrabber(self.chrome_url, self.chrome_session_id)
+        self.grabber.reset_game_state()
+        self.wait_for_new_game()
+
+    # Moves on to the next game if non-stop mode is enabled
+    # Returns True if a new game was loaded, False if the bot should stop
+    def start_next_game(self):
+        if self.enable_non_stop_puzzles and self.board_state["is_puzzles"]:
+            self.go_to_next_puzzle()
+            return True
+        elif self.enable_non_stop_matches and not self.enable_non_stop_puzzles:
+            self.find_new_online_match()
+            return True
+        return False
+
+    # Opens the opening book, the tablebases, the engine and the analysis cache
+    # Returns the engine, None if something could not be opened (the error is sent to the GUI)
+    def init_engine(self):
+        # Open the Polyglot opening book (if one is selected)
+        # The file is memory-mapped and searched by the position key
+        if self.book_path != "":
+            try:
+                self.book = chess.polyglot.open_reader(self.book_path)
+            except (OSError, ValueError):
+                self.sender.send(messages.ERROR, messages.ERR_BOOK)
+                return None
+
+        # Open the Syzygy tablebases (if a directory is selected)
+        # At most 128 table files are kept open, the least recently used are closed first
+        if self.syzygy_path != "":
+            try:
+                self.tablebase = chess.syzygy.open_tablebase(self.syzygy_path, max_fds=128)
+            except OSError:
+                self.tablebase = None
+            if self.tablebase is None or not self.tablebase.dtz:
+                self.sender.send(messages.ERROR, messages.ERR_SYZYGY)
+                return None
+
+            # Table names look like "KQvK", so the number of pieces is the length minus the "v"
+            self.tablebase_max_pieces = max(len(name) - 1 for name in self.tablebase.dtz)
 
         # Initialize Stockfish
+        # The engine is kept alive across games in non-stop mode
         parameters = {
             "Threads": self.cpu_threads,
             "Hash": self.memory,
-            "Ponder": "true",
             "Slow Mover": self.slow_mover,
-            "Skill Level": self.skill_level
+            "Skill Level": self.skill_level,
+            # Time kept aside on every move for the page, the mouse and the network
+            "Move Overhead": self.clock_margin
         }
         try:
-            stockfish = Stockfish(path=self.stockfish_path, depth=self.stockfish_depth, parameters=parameters)
+            engine = Engine(self.stockfish_path, self.stockfish_depth, parameters, self.multipv)
         except PermissionError:
-            self.pipe.send("ERR_PERM")
-            return
-        except OSError:
-            self.pipe.send("ERR_EXE")
-            return
-
-        try:
-            # Return if the board element is not found
-            self.grabber.update_board_elem()
-            if self.grabber.get_board() is None:
-                self.pipe.send("ERR_BOARD")
-                return
+            self.sender.send(messages.ERROR, messages.ERR_PERM)
+            return None
+        except (OSError, chess.engine.EngineError):
+            self.sender.send(messages.ERROR, messages.ERR_EXE)
+            return None
 
-            # Find out what color the player has
-            self.is_white = self.grabber.is_white()
-            if self.is_white is None:
-                self.pipe.send("ERR_COLOR")
-                return
+        # Let the engine use the tablebases in its own search as well
+        if self.tablebase is not None:
+            engine.set_syzygy_path(self.syzygy_path)
 
-            # Get the starting position
-            # Return if the starting position is not found
-            move_list = self.grabber.get_move_list()
-            if move_list is None:
-                self.pipe.send("ERR_MOVES")
-                return
+        # Open the analysis cache (if enabled)
+        # Below skill level 20 Stockfish plays randomly weakened moves, which
+        # the cache would replay every time, so it is only used at full strength
+        if self.enable_analysis_cache and self.skill_level >= 20:
+            self.analysis_cache = AnalysisCache("analysis_cache.sqlite3")
 
-            # Check if the game is over
-            score_pattern = r"([0-9]+)\-([0-9]+)"
-            if len(move_list) > 0 and re.match(score_pattern, move_list[-1]):
-                self.pipe.send("ERR_GAMEOVER")
-                return
+        return engine
 
-            # Update the board with the starting position
-            board = chess.Board()
-            for move in move_list:
-                board.push_san(move)
-            move_list_uci = [move.uci() for move in board.move_stack]
+    def run(self):
+        self.sender = MessageSender(self.pipe)
+        if self.enable_tracing:
+            tracing.enable("Stockfish Bot")
 
-            # Update Stockfish with the starting position
-            stockfish.set_position(move_list_uci)
+        if self.website == "chesscom":
+            self.grabber = ChesscomGrabber(self.chrome_url, self.chrome_session_id)
+        else:
+            self.grabber = LichessGrabber(self.chrome_url, self.chrome_session_id)
 
-            # Notify GUI that bot is ready
-            self.pipe.send("START")
+        # Create the input backend (None when the moves are never made with the mouse)
+        if self.input_backend_name is not None:
+            try:
+                self.input_backend = create_backend(self.input_backend_name, self.mouse_latency)
+            except InputBackendError as e:
+                print(e)
+                self.sender.send(messages.ERROR, messages.ERR_INPUT)
+                return
 
-            # Send the first moves to the GUI (if there are any)
-            if len(move_list) > 0:
-                self.pipe.send("M_MOVE" + ",".join(move_list))
+        engine = self.init_engine()
+        if engine is None:
+            return
 
-            # Start the game loop
+        try:
+            # Keep playing games in the same process (and with the same
+            # engine and browser session) as long as non-stop mode allows it
+            first_game = True
             while True:
-                # Act if it is the player's turn
-                if (self.is_white and board.turn == chess.WHITE) or (not self.is_white and board.turn == chess.BLACK):
-                    # Think of a move
-                    move = None
-                    move_count = len(board.move_stack)
-                    if self.bongcloud and move_count <= 3:
-                        if move_count == 0:
-                            move = "e2e3"
-                        elif move_count == 1:
-                            move = "e7e6"
-                        elif move_count == 2:
-                            move = "e1e2"
-                        elif move_count == 3:
-                            move = "e8e7"
-
-                        # Hardcoded bongcloud move is not legal,
-                        # so find a legal move
-                        if not board.is_legal(chess.Move.from_uci(move)):
-                            move = stockfish.get_best_move()
-                    else:
-                        move = stockfish.get_best_move()
-
-                    # Wait for keypress or player movement if in manual mode
-                    self_moved = False
-                    if self.enable_manual_mode:
-                        move_start_pos, move_end_pos = self.get_move_pos(move)
-                        self.overlay_queue.put([
-                            ((int(move_start_pos[0]), int(move_start_pos[1])), (int(move_end_pos[0]), int(move_end_pos[1]))),
-                        ])
-                        while True:
-                            if keyboard.is_pressed("3"):
-                                break
-
-                            if len(move_list) != len(self.grabber.get_move_list()):
-                                self_moved = True
-                                move_list = self.grabber.get_move_list()
-                                move_san = move_list[-1]
-                                move = board.parse_san(move_san).uci()
-                                board.push_uci(move)
-                                stockfish.make_moves_from_current_position([move])
-                                break
-
-                    if not self_moved:
-                        move_san = board.san(chess.Move(chess.parse_square(move[0:2]), chess.parse_square(move[2:4])))
-                        board.push_uci(move)
-                        stockfish.make_moves_from_current_position([move])
-                        move_list.append(move_san)
-                        if self.enable_mouseless_mode and not self.grabber.is_game_puzzles():
-                            self.grabber.make_mouseless_move(move, move_count + 1)
-                        else:
-                            self.make_move(move)
-
-                    self.overlay_queue.put([])
+                finished = self.play_game(engine, first_game)
 
-                    # Send the move to the GUI
-                    self.pipe.send("S_MOVE" + move_san)
-
-                    # Check if the game is over
-                    if board.is_checkmate():
-                        # Send restart message to GUI
-                        if self.enable_non_stop_puzzles and self.grabber.is_game_puzzles():
-                            self.go_to_next_puzzle()
-                        elif self.enable_non_stop_matches and not self.enable_non_stop_puzzles:
-                            self.find_new_online_match()
-                        return
-
-                    time.sleep(0.1)
-
-                # Wait for a response from the opponent
-                # by finding the differences between
-                # the previous and current position
-                previous_move_list = move_list.copy()
-                while True:
-                    if self.grabber.is_game_over():
-                        # Send restart message to GUI
-                        if self.enable_non_stop_puzzles and self.grabber.is_game_puzzles():
-                            self.go_to_next_puzzle()
-                        elif self.enable_non_stop_matches and not self.enable_non_stop_puzzles:
-                            self.find_new_online_match()
-                        return
-                    move_list = self.grabber.get_move_list()
-                    if move_list is None:
-                        return
-                    if len(move_list) > len(previous_move_list):
-                        break
+                # Don't leave a ponder search running into the next game
+                engine.stop_ponder()
 
-                # Get the move that the opponent made
-                move = move_list[-1]
-                self.pipe.send("S_MOVE" + move)
-                board.push_san(move)
-                stockfish.make_moves_from_current_position([str(board.peek())])
-                if board.is_checkmate():
-                    # Send restart message to GUI
-                    if self.enable_non_stop_puzzles and self.grabber.is_game_puzzles():
-                        self.go_to_next_puzzle()
-                    elif self.enable_non_stop_matches and not self.enable_non_stop_puzzles:
-                        self.find_new_online_match()
+                if not finished:
                     return
+                if not self.start_next_game():
+                    return
+                first_game = False
         except Exception as e:
             print(e)
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             print(exc_type, fname, exc_tb.tb_lineno)
+
+            # Count the error, and send the metrics that were not sent yet
+            self.metrics.increment("chessbot_errors_total")
+            try:
+                self.send_metrics()
+            except (BrokenPipeError, OSError):
+                pass
+        finally:
+            # Stop the engine process
+            try:
+                engine.quit()
+            except chess.engine.EngineError:
+                pass
+
+    # Plays a single game until it is over
+    # Returns True if the game finished, False if the bot should stop
+    def play_game(self, engine, first_game):
+        # sourcery skip: extract-duplicate-method, switch, use-fstring-for-concatenation
+        state = self.update_board_state()
+
+        # Return if the board element is not found
+        if state["board"] is None:
+            self.sender.send(messages.ERROR, messages.ERR_BOARD)
+            return False
+
+        # Find out what color the player has
+        self.is_white = state["is_white"]
+        if self.is_white is None:
+            self.sender.send(messages.ERROR, messages.ERR_COLOR)
+            return False
+
+        # Get the starting position
+        # Return if the starting position is not found
+        move_list = state["moves"]
+        if move_list is None:
+            self.sender.send(messages.ERROR, messages.ERR_MOVES)
+            return False
+
+        # Check if the game is over
+        score_pattern = r"([0-9]+)\-([0-9]+)"
+        if len(move_list) > 0 and re.match(score_pattern, move_list[-1]):
+            if first_game:
+                self.sender.send(messages.ERROR, messages.ERR_GAMEOVER)
+            return False
+
+        # Update the board with the starting position
+        sync = BoardSync()
+        sync.update(move_list)
+        board = sync.board
+
+        # Let the engine know that this is a new game
+        # (it receives the position with every search)
+        engine.new_game()
+
+        # True when the opponent played the move the engine was pondering on
+        ponder_hit = False
+
+        # When the last move of the opponent was noticed, None before the first one
+        opponent_moved_at = None
+
+        # Notify GUI that bot is ready and send
+        # the first moves (if there are any)
+        self.sender.add(messages.START)
+        if len(sync.moves) > 0:
+            self.sender.add(messages.MOVES, [0, sync.moves])
+        self.sender.flush()
+
+        # Start the game loop
+        while True:
+            # Act if it is the player's turn
+            if (self.is_white and board.turn == chess.WHITE) or (not self.is_white and board.turn == chess.BLACK):
+                # Think of a move
+                with tracing.span("get_move", "bot"):
+                    move, suggested_move = self.get_move(engine, board, ponder_hit)
+                ponder_hit = False
+
+                # No move means that the game is over
+                if move is None:
+                    return True
+                move_count = len(board.move_stack)
+
+                # Send the search results to the GUI
+                self.sender.flush()
+
+                # Refresh the board position, in case the page was scrolled or resized
+                self.grabber.refresh_geometry()
+
+                # Wait for keypress or player movement if in manual mode
+                self_moved = False
+                if self.enable_manual_mode:
+                    import keyboard
+                    self.sender.send(messages.ARROWS, [self.grabber.get_board_rect(), self.get_arrows(move)])
+                    while True:
+                        if keyboard.is_pressed("3"):
+                            break
+
+                        # Only look at the move list when the page reports a change,
+                        # keeping the wait short so that keypresses are not missed
+                        if not self.grabber.wait_for_change(timeout=0.05):
+                            continue
+
+                        new_move_list = self.update_board_state()["moves"]
+                        if new_move_list is None:
+                            continue
+
+                        change = sync.update(new_move_list)
+                        if change is not None:
+                            self_moved = True
+                            self.send_moves_change(change)
+                            break
+
+                if not self_moved:
+                    move_san = sync.push(move)
+                    start = time.perf_counter()
+                    with tracing.span("input", "bot", move=move):
+                        if self.enable_mouseless_mode and not self.board_state["is_puzzles"]:
+                            self.grabber.make_mouseless_move(move, move_count + 1)
+                        else:
+                            self.make_move(move)
+                    self.metrics.observe("chessbot_input_seconds", time.perf_counter() - start)
+                    if opponent_moved_at is not None:
+                        self.metrics.observe("chessbot_move_latency_seconds", time.perf_counter() - opponent_moved_at)
+
+                    # Send the move to the GUI
+                    self.send_moves_change((len(board.move_stack) - 1, [move_san]))
+
+                self.sender.send(messages.ARROWS, [self.grabber.get_board_rect(), []])
+
+                # Think on the opponent's time if the move that was played is the one the engine suggested
+                if len(board.move_stack) > 0 and board.peek().uci() == suggested_move:
+                    engine.start_ponder(board)
+
+                # Check if the game is over
+                if board.is_checkmate():
+                    return True
+
+                time.sleep(0.1)
+
+            # Wait for a response from the opponent
+            # by finding the differences between
+            # the board and the move list on the page.
+            # Between checks, block in the browser until the
+            # move list or the game over window changes
+            with tracing.span("wait_for_opponent", "bot"):
+                while True:
+                    webdriver_calls = self.grabber.webdriver_calls
+                    state = self.update_board_state()
+                    if state["is_game_over"]:
+                        return True
+                    if state["moves"] is None:
+                        return False
+                    change = sync.update(state["moves"])
+                    if change is not None:
+                        break
+                    self.grabber.wait_for_change()
+                    self.metrics.observe("chessbot_webdriver_calls", self.grabber.webdriver_calls - webdriver_calls)
+            opponent_moved_at = time.perf_counter()
+
+            # Send the opponent's move to the GUI. Takebacks or missed
+            # updates can change more moves than the last one
+            self.send_moves_change(change)
+            index, moves = change
+            single_move = index == len(board.move_stack) - 1 and len(moves) == 1
+
+            if engine.pondering and single_move and board.peek().uci() == engine.ponder_move:
+                # The engine is already searching this position
+                ponder_hit = True
+            else:
+                engine.stop_ponder()
+            if board.is_checkmate():
+                return True
@@ -0,0 +1,116 @@
+import collections
+import os
+import threading
+import time
+
+# Span tracing of the game loop, exported as Chrome trace events
+# (open the exported file in https://ui.perfetto.dev or chrome://tracing).
+# Every process has one tracer, which is off until enable() is called.
+# Spans are kept in a ring buffer, so a long session only keeps the
+# latest ones. The bot and the overlay send their spans to the GUI
+# (see messages.TRACE), which exports the spans of every process:
+#
+#     with tracing.span("snapshot", "grabber"):
+#         state = grabber.snapshot()
+
+
+# Span that records nothing, returned while tracing is off
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        self.tracer.spans.append((self.name, self.category, self.start, end - self.start, threading.get_ident(), self.args))
+        return False
+
+
+class Tracer:
+    def __init__(self, capacity=100000):
+        self.enabled = False
+        self.process_name = None
+        self.spans = collections.deque(maxlen=capacity)
+
+        # Names of the threads that recorded spans, Ex. {140230: "MainThread"}
+        self.thread_names = {}
+
+    def enable(self, process_name):
+        self.process_name = process_name
+        self.enabled = True
+
+    # Returns a context manager that records the time spent inside it
+    # args are shown with the span (Ex. span("execute_script", "webdriver", command="executeScript"))
+    def span(self, name, category="", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    # Removes the recorded spans and returns them as Chrome trace events,
+    # together with the names of the process and of its threads
+    def drain(self):
+        pid = os.getpid()
+        for thread in threading.enumerate():
+            self.thread_names[thread.ident] = thread.name
+
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.process_name or str(pid)}}]
+        events += [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.thread_names.items()
+        ]
+        while self.spans:
+            name, category, start, duration, tid, args = self.spans.popleft()
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+        return events
+
+
+# The tracer of this process
+tracer = Tracer()
+
+
+def enable(process_name):
+    tracer.enable(process_name)
+
+
+def disable():
+    tracer.enabled = False
+
+
+def is_enabled():
+    return tracer.enabled
+
+
+def span(name, category="", **args):
+    return tracer.span(name, category, **args)
+
+
+def drain():
+    return tracer.drain()
@@ -1,3 +1,5 @@
+import os
+
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium import webdriver
 
@@ -9,9 +11,12 @@ def char_to_num(char):
 
 
 # Attaches to a running webdriver
+# executor_url can also be a command executor object (Ex. a webdriver_replay.ReplayExecutor)
+# Every command and response is recorded to record_path (see webdriver_replay.py)
+# if it is given or if the CHESS_BOT_RECORD_WEBDRIVER environment variable is set
 # Returns the webdriver
 # Taken from https://stackoverflow.com/a/48194907/5868441
-def attach_to_session(executor_url, session_id):
+def attach_to_session(executor_url, session_id, record_path=None):
     original_execute = WebDriver.execute
 
     def new_command_execute(self, command, params=None):
@@ -29,4 +34,33 @@ def attach_to_session(executor_url, session_id):
     # Replace the patched function with original function
     WebDriver.execute = original_execute
 
+    if record_path is None:
+        record_path = os.environ.get("CHESS_BOT_RECORD_WEBDRIVER")
+    if record_path:
+        from webdriver_replay import record_session
+        record_session(driver, record_path)
+
     return driver
+
+
+# Returns the p-th percentile (0-100) of the values (nearest rank)
+def percentile(values, p):
+    values = sorted(values)
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+# Returns the statistics of a list of durations (in seconds) in milliseconds
+# Ex. {"count": 40, "mean": 12.1, "p50": 10.3, "p95": 25.0, "p99": 31.2, "max": 31.2}
+def get_latency_stats(values):
+    if not values:
+        return {"count": 0}
+    values = [value * 1000 for value in values]
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
@@ -0,0 +1,248 @@
+import argparse
+import collections
+import copy
+import json
+import re
+import sys
+import time
+
+from selenium.common import WebDriverException
+
+from grabbers.grabber import GEOMETRY_VERSION_SCRIPT, PAGE_FUNCTION_SCRIPT, WAIT_FOR_CHANGE_SCRIPT
+from utilities import attach_to_session, get_latency_stats
+
+# Record and replay of WebDriver traffic.
+# A recording holds every command the bot sent to ChromeDriver during a
+# session with its response and how long it took, one JSON object per line:
+# the first line is {"version", "session_id"}, every other line is
+# {"c": command, "p": parameters, "k": key, "r": response, "t": seconds}.
+# The key names the scripts the grabbers send (see ReplayExecutor.get_key),
+# so a recording still replays after a script has been edited.
+# A ReplayExecutor serves the responses back without a browser, so grabber
+# code can be benchmarked offline and the round trips it makes counted.
+#
+# Recording: set the CHESS_BOT_RECORD_WEBDRIVER environment variable to the
+# file to record to before starting the GUI (the file is overwritten every
+# time the bot starts)
+# Replay: python src/webdriver_replay.py --recording session.jsonl --website lichess
+
+RECORDING_VERSION = 1
+
+# The scripts of the grabbers that are sent as they are, by name
+SCRIPT_NAMES = {
+    WAIT_FOR_CHANGE_SCRIPT: "wait_for_change",
+    GEOMETRY_VERSION_SCRIPT: "geometry_version",
+}
+
+# The script that installs a page function (see Grabber.call_page_function)
+INSTALL_PAGE_FUNCTION_PATTERN = re.compile(r"window\[('[^']*')\] = function \(\) \{")
+
+
+# Records every command sent through the driver to the given file
+def record_session(driver, path):
+    f = open(path, "w", encoding="utf-8")
+    f.write(json.dumps({"version": RECORDING_VERSION, "session_id": driver.session_id}) + "\n")
+    f.flush()
+
+    executor = driver.command_executor
+    original_execute = executor.execute
+
+    def execute(command, params=None):
+        start = time.perf_counter()
+        response = original_execute(command, params)
+        elapsed = time.perf_counter() - start
+
+        # Written line by line, as the bot process can be killed at any time
+        f.write(json.dumps({"c": command, "p": ReplayExecutor.strip_session(params),
+                            "k": ReplayExecutor.get_key(command, params), "r": response, "t": elapsed},
+                           separators=(",", ":")) + "\n")
+        f.flush()
+        return response
+
+    executor.execute = execute
+
+
+# Reads a recording
+# Returns (session id, records)
+def read_recording(path):
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != RECORDING_VERSION:
+            raise ValueError(f"Unsupported recording version {header.get('version')}")
+        return header["session_id"], [json.loads(line) for line in f if line.strip()]
+
+
+# Raised when the recording has no more responses for a command
+class ReplayEnd(WebDriverException):
+    pass
+
+
+# Command executor that answers with the responses of a recording.
+# Every distinct command (name and parameters) gets its recorded responses
+# in the recorded order. When they run out, the last one is repeated, or
+# ReplayEnd is raised if strict is True. Commands that are not in the
+# recording (Ex. a script the grabbers didn't send back then) raise WebDriverException.
+# Every call sleeps for latency seconds, or for the recorded time if
+# latency is None, to simulate the round trip to the browser
+class ReplayExecutor:
+    def __init__(self, records, latency=0.0, strict=False):
+        self.latency = latency
+        self.strict = strict
+
+        # Ex. self.responses[key] -> [(response, seconds), ...]
+        self.responses = collections.defaultdict(list)
+        for record in records:
+            key = record.get("k") or self.get_key(record["c"], record["p"])
+            self.responses[key].append((record["r"], record["t"]))
+        self.positions = collections.Counter()
+
+        # Number of calls per command name
+        self.calls = collections.Counter()
+
+    @staticmethod
+    def strip_session(params):
+        return {name: value for name, value in (params or {}).items() if name != "sessionId"}
+
+    # Returns the name of a script: the page function it calls or installs
+    # (Ex. "call __chessBotSnapshot"), the name of a grabber script
+    # (see SCRIPT_NAMES), None for any other script
+    @staticmethod
+    def get_script_name(script, args):
+        if script == PAGE_FUNCTION_SCRIPT and args:
+            return "call " + str(args[0])
+        match = INSTALL_PAGE_FUNCTION_PATTERN.match(script)
+        if match is not None:
+            return "install " + match.group(1).strip("'")
+        return SCRIPT_NAMES.get(script)
+
+    # Returns the key of a command: its name and parameters, with
+    # the scripts of the grabbers replaced by their name
+    @classmethod
+    def get_key(cls, command, params):
+        params = cls.strip_session(params)
+        if isinstance(params.get("script"), str):
+            name = cls.get_script_name(params["script"], params.get("args") or [])
+            if name is not None:
+                params = dict(params, script=name)
+        return command + json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+    def execute(self, command, params=None):
+        key = self.get_key(command, params)
+        responses = self.responses.get(key)
+        if not responses:
+            script = self.strip_session(params).get("script")
+            if isinstance(script, str):
+                # Name the script, or show its first line if it isn't one of the grabbers'
+                name = self.get_script_name(script, params.get("args") or []) or script.strip().split("\n")[0][:80]
+                raise WebDriverException(f"The script {name!r} ({command}) is not in the recording")
+            raise WebDriverException(f"{command} is not in the recording")
+
+        position = self.positions[key]
+        if position >= len(responses):
+            if self.strict:
+                raise ReplayEnd(f"The recording has no more responses for {command}")
+            position = len(responses) - 1
+        else:
+            self.positions[key] += 1
+        response, elapsed = responses[position]
+
+        delay = elapsed if self.latency is None else self.latency
+        if delay > 0:
+            time.sleep(delay)
+        self.calls[command] += 1
+
+        # The driver changes the response it gets, so hand out a copy
+        return copy.deepcopy(response)
+
+
+# Returns a driver that replays the recording (see ReplayExecutor)
+def replay_session(path, latency=0.0, strict=False):
+    session_id, records = read_recording(path)
+    return attach_to_session(ReplayExecutor(records, latency, strict), session_id)
+
+
+# Returns the number of moves played during a recording, counted from
+# the move lists in the snapshot responses (see Grabber.snapshot)
+def count_moves(records):
+    moves = 0
+    last_length = None
+    for record in records:
+        value = record["r"].get("value") if isinstance(record["r"], dict) else None
+        if isinstance(value, list) and len(value) == 1:
+            # The fast path of Grabber.call_page_function
+            value = value[0]
+        if not isinstance(value, dict) or not isinstance(value.get("moves"), list):
+            continue
+
+        length = len(value["moves"])
+        if last_length is not None and length > last_length:
+            moves += length - last_length
+        last_length = length
+    return moves
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a WebDriver recording through a grabber, without a browser")
+    parser.add_argument("--recording", required=True, help="the recorded session")
+    parser.add_argument("--website", choices=["chesscom", "lichess"], required=True, help="the site of the recording")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated round trip time per command in seconds (default: 0)")
+    parser.add_argument("--recorded-latency", action="store_true", help="sleep for the recorded time of every command")
+    parser.add_argument("--output", default=None, help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    session_id, records = read_recording(args.recording)
+    moves = count_moves(records)
+
+    # Replay every recorded snapshot through the current grabber code
+    from grabbers.chesscom_grabber import ChesscomGrabber
+    from grabbers.lichess_grabber import LichessGrabber
+    executor = ReplayExecutor(records, None if args.recorded_latency else args.latency, strict=True)
+    if args.website == "chesscom":
+        grabber = ChesscomGrabber(executor, session_id)
+    else:
+        grabber = LichessGrabber(executor, session_id)
+
+    snapshot_times = []
+    errors = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            grabber.snapshot()
+        except ReplayEnd:
+            break
+        except WebDriverException:
+            # The grabber sent something the recording doesn't have
+            errors += 1
+            break
+        snapshot_times.append(time.perf_counter() - start)
+
+    results = {
+        "recording": {
+            "commands": len(records),
+            "by_command": dict(collections.Counter(record["c"] for record in records)),
+            "time": sum(record["t"] for record in records),
+            "moves": moves,
+            "round_trips_per_move": len(records) / moves if moves > 0 else None,
+        },
+        "replay": {
+            "snapshots": len(snapshot_times),
+            "commands": sum(executor.calls.values()),
+            "by_command": dict(executor.calls),
+            "round_trips_per_snapshot": sum(executor.calls.values()) / len(snapshot_times) if snapshot_times else None,
+            "snapshot_time": get_latency_stats(snapshot_times),
+            "unknown_commands": errors,
+        },
+    }
+
+    data = json.dumps(results, indent=2)
+    if args.output is None:
+        print(data)
+    else:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())